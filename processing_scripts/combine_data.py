@@ -1,5 +1,21 @@
 import pandas as pd
 import numpy as np
+from functools import reduce
+
+# Measurement columns carried into the wide dataset for each device type
+EVENT_COLUMNS = ['Event_Normal', 'Event_Fault', 'Event_GeneratorTrip', 'Event_LoadChange']
+PHASOR_MEASUREMENTS = ['VA_Magnitude', 'VA_Phase', 'IA_Magnitude', 'IA_Phase']
+SMARTMETER_MEASUREMENTS = ['VA', 'SPA']
+PHASOR_VALUES = PHASOR_MEASUREMENTS + EVENT_COLUMNS
+SMARTMETER_VALUES = SMARTMETER_MEASUREMENTS + EVENT_COLUMNS
+
+# Column dtypes of the parsed device CSVs, so read_csv does not have to infer them.
+# Event indicators are 0/1 flags and stay nullable int8 through the pivots
+EVENT_DTYPES = dict.fromkeys(EVENT_COLUMNS, 'Int8')
+PHASOR_DTYPES = {'Timestamp': 'float64', 'PhasorID': 'str',
+                 **dict.fromkeys(PHASOR_MEASUREMENTS, 'float64'), **EVENT_DTYPES}
+SMARTMETER_DTYPES = {'Timestamp': 'float64', 'MeterID': 'str',
+                     **dict.fromkeys(SMARTMETER_MEASUREMENTS, 'float64'), **EVENT_DTYPES}
 
 # Deduplication function
 def deduplicate_dataset(df, subset=None):
@@ -9,27 +25,34 @@ def deduplicate_dataset(df, subset=None):
 # Handling missing timestamps for NS3
 def handle_missing_timestamps_ns3(ns3_df, all_timestamps):
     """Fill in missing NS3 timestamps by inserting empty rows for missing values."""
-    ns3_timestamps = set(ns3_df['Timestamp'].unique())
-    missing_timestamps = all_timestamps - ns3_timestamps
-
-    if missing_timestamps:
-        print(f"Missing NS3 timestamps: {sorted(missing_timestamps)}")
-        for ts in missing_timestamps:
-            # Append rows with NaN values for missing timestamps
-            ns3_df = pd.concat(
-                [ns3_df, pd.DataFrame({'Timestamp': [ts], 'packets_sent': [0], 'packets_received': [0], 
-                                       'packets_dropped': [0], 'packet_size_mean': [np.nan], 'packet_size_var': [np.nan]})],
-                ignore_index=True
-            )
+    missing_timestamps = np.setdiff1d(all_timestamps, ns3_df['Timestamp'].to_numpy())
+
+    if missing_timestamps.size:
+        print(f"Missing NS3 timestamps: {missing_timestamps.tolist()}")
+        # Build all the missing rows at once and append them with a single concat
+        missing_df = pd.DataFrame({'Timestamp': missing_timestamps, 'packets_sent': 0, 'packets_received': 0,
+                                   'packets_dropped': 0, 'packet_size_mean': np.nan, 'packet_size_var': np.nan})
+        ns3_df = pd.concat([ns3_df, missing_df], ignore_index=True)
     return ns3_df.sort_values('Timestamp').reset_index(drop=True)
 
+# Pivot device data to one column per (value, device)
+def pivot_device_data(device_df, id_column, values):
+    """Pivot deduplicated device rows wide, indexed by Timestamp."""
+    # Rows are unique per (Timestamp, id) after deduplication, so no aggregation is
+    # needed; unstack keeps each value column's dtype (pivot would fall back to object
+    # for the mixed float64/Int8 columns) and the layout matches pivot_table output
+    device_wide = device_df.set_index(['Timestamp', id_column])[values].unstack(id_column)
+    device_wide = device_wide.dropna(axis=1, how='all').sort_index(axis=1)
+    device_wide.columns = ['{}_{}'.format(var, device) for var, device in device_wide.columns]
+    return device_wide
+
 # Combine data
 def combine_data():
-    chunk_size = 1000
-
-    # Read datasets
-    phasor_df = pd.read_csv("Parsed_Phasor_data.csv")
-    smartmeter_df = pd.read_csv("Parsed_SmartMeter_data.csv")
+    # Read datasets, loading only the device columns that end up in the pivots
+    phasor_df = pd.read_csv("Parsed_Phasor_data.csv", usecols=['Timestamp', 'PhasorID'] + PHASOR_VALUES,
+                            dtype=PHASOR_DTYPES)
+    smartmeter_df = pd.read_csv("Parsed_SmartMeter_data.csv", usecols=['Timestamp', 'MeterID'] + SMARTMETER_VALUES,
+                                dtype=SMARTMETER_DTYPES)
     ns3_df = pd.read_csv("Aggregated_Network_Data.csv")  # Adjusted file name for simplicity
     dse_df = pd.read_csv("state_estimation_results.csv")
 
@@ -39,54 +62,38 @@ def combine_data():
     ns3_df = deduplicate_dataset(ns3_df, subset=['Timestamp'])
     dse_df = deduplicate_dataset(dse_df, subset=['Timestamp'])
 
-    # Collect all unique timestamps
-    all_timestamps = set(phasor_df['Timestamp'].unique()) | set(smartmeter_df['Timestamp'].unique()) | \
-                     set(ns3_df['Timestamp'].unique()) | set(dse_df['Timestamp'].unique())
+    # Collect all unique timestamps (sorted array)
+    all_timestamps = reduce(np.union1d, [df['Timestamp'].to_numpy()
+                                         for df in (phasor_df, smartmeter_df, ns3_df, dse_df)])
 
     # Handle missing timestamps in NS3
     ns3_df = handle_missing_timestamps_ns3(ns3_df, all_timestamps)
 
     # Check DSE timestamp alignment
-    dse_timestamps = set(dse_df['Timestamp'].unique())
-    missing_dse_timestamps = all_timestamps - dse_timestamps
-    if missing_dse_timestamps:
-        print(f"Missing DSE timestamps: {sorted(missing_dse_timestamps)}")
-        for ts in missing_dse_timestamps:
-            dse_df = pd.concat(
-                [dse_df, pd.DataFrame({'Timestamp': [ts], 'Node_0_Magnitude': [np.nan], 'Node_0_Phase': [np.nan]})],
-                ignore_index=True
-            )
+    missing_dse_timestamps = np.setdiff1d(all_timestamps, dse_df['Timestamp'].to_numpy())
+    if missing_dse_timestamps.size:
+        print(f"Missing DSE timestamps: {missing_dse_timestamps.tolist()}")
+        missing_dse_df = pd.DataFrame({'Timestamp': missing_dse_timestamps,
+                                       'Node_0_Magnitude': np.nan, 'Node_0_Phase': np.nan})
+        dse_df = pd.concat([dse_df, missing_dse_df], ignore_index=True)
 
     # Pivot phasor data
-    phasor_df['PhasorID'] = phasor_df['PhasorID'].astype(str)
-    phasor_wide = phasor_df.pivot_table(
-        index='Timestamp',
-        columns='PhasorID',
-        values=['VA_Magnitude', 'VA_Phase', 'IA_Magnitude', 'IA_Phase',
-                'Event_Normal', 'Event_Fault', 'Event_GeneratorTrip', 'Event_LoadChange']
-    )
-    phasor_wide.columns = ['{}_{}'.format(var, phasor) for var, phasor in phasor_wide.columns]
-    phasor_wide = phasor_wide.reset_index()
+    phasor_wide = pivot_device_data(phasor_df, 'PhasorID', PHASOR_VALUES)
 
     # Pivot smartmeter data
-    smartmeter_df['MeterID'] = smartmeter_df['MeterID'].astype(str)
-    smartmeter_wide = smartmeter_df.pivot_table(
-        index='Timestamp',
-        columns='MeterID',
-        values=['VA', 'SPA', 'Event_Normal', 'Event_Fault', 'Event_GeneratorTrip', 'Event_LoadChange']
-    )
-    smartmeter_wide.columns = ['{}_{}'.format(var, meter) for var, meter in smartmeter_wide.columns]
-    smartmeter_wide = smartmeter_wide.reset_index()
-
-    # Merge all datasets
-    combined_df = pd.DataFrame({'Timestamp': sorted(all_timestamps)})
-    combined_df = combined_df.merge(phasor_wide, on='Timestamp', how='left')
-    combined_df = combined_df.merge(smartmeter_wide, on='Timestamp', how='left')
-    combined_df = combined_df.merge(ns3_df, on='Timestamp', how='left')
-    combined_df = combined_df.merge(dse_df, on='Timestamp', how='left')
-
-    # Fill missing values (e.g., forward-fill for continuity where appropriate)
-    combined_df.fillna(method='ffill', inplace=True)
+    smartmeter_wide = pivot_device_data(smartmeter_df, 'MeterID', SMARTMETER_VALUES)
+
+    # Merge all datasets in a single index join on the (unique, sorted) Timestamp key
+    combined_df = pd.DataFrame(index=pd.Index(all_timestamps, name='Timestamp'))
+    combined_df = combined_df.join(
+        [phasor_wide, smartmeter_wide, ns3_df.set_index('Timestamp'), dse_df.set_index('Timestamp')],
+        how='left'
+    ).reset_index()
+
+    # Forward-fill the measurement columns for continuity; the Timestamp key and
+    # the Event_* indicator columns are left untouched
+    meas_cols = [c for c in combined_df.columns if c != 'Timestamp' and not c.startswith('Event_')]
+    combined_df[meas_cols] = combined_df[meas_cols].ffill()
 
     # Save combined dataset
     combined_df.to_csv("Combined_Dataset.csv", index=False)
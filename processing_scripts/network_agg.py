@@ -1,43 +1,59 @@
 import pandas as pd
+import numpy as np
+
+# Event types written by network_infodump.py
+EVENT_TYPE_DTYPE = pd.CategoricalDtype(['sent', 'received', 'dropped'])
+
+# Slots per window in the dense event counter: sent, received, dropped and a
+# discard slot that missing/unknown event types (category code -1) land in
+EVENT_SLOTS = 4
+
+# Per-window packet counters
+PACKET_COUNT_COLUMNS = ['packets_sent', 'packets_received', 'packets_dropped']
 
 # Function to process and aggregate network data
-def process_and_aggregate_network_data(file_paths, output_file_granular, output_file_summary, chunk_size=10000):
-    aggregated_data = []
-
-    for file_path in file_paths:
-        for chunk in pd.read_csv(file_path, chunksize=chunk_size):
-            # Convert to milliseconds and round
-            chunk['Timestamp'] = (chunk['Timestamp'] * 1000).round().astype(int)
-            
-            # Group by 1ms window and NodeID, aggregating data within each window
-            agg_chunk = chunk.groupby(['Timestamp', 'NodeID']).agg(
-                packets_sent=('EventType', lambda x: (x == 'sent').sum()),
-                packets_received=('EventType', lambda x: (x == 'received').sum()),
-                packets_dropped=('EventType', lambda x: (x == 'dropped').sum()),
-                packet_size_mean=('PacketSize', 'mean'),
-                packet_size_var=('PacketSize', 'var')
-            ).reset_index()
-
-            aggregated_data.append(agg_chunk)
-
-    # Concatenate all aggregated data
-    aggregated_df = pd.concat(aggregated_data, ignore_index=True)
-
-    # Drop any rows with NaN in Timestamp
-    aggregated_df = aggregated_df.dropna(subset=['Timestamp'])
-
-    # Ensure the Timestamp column is of integer type
-    aggregated_df['Timestamp'] = aggregated_df['Timestamp'].astype(int)
-
-    # Fill in missing timestamps by creating a DataFrame with all the timestamps in the range
+def process_and_aggregate_network_data(file_paths, output_file_granular, output_file_summary):
+    # Read the parsed traces whole and aggregate them in a single groupby; the
+    # number of (Timestamp, NodeID) windows is what bounds the aggregate, so there
+    # is nothing to gain from chunked reads and partial aggregates
+    network_df = pd.concat(
+        [pd.read_csv(file_path, dtype={'EventType': EVENT_TYPE_DTYPE, 'NodeID': np.int32})
+         for file_path in file_paths],
+        ignore_index=True
+    )
+
+    # Convert to milliseconds and round
+    network_df['Timestamp'] = (network_df['Timestamp'] * 1000).round().astype(int)
+
+    # Group by 1ms window and NodeID, aggregating the packet sizes within each window
+    grouped = network_df.groupby(['Timestamp', 'NodeID'])
+    aggregated_df = grouped['PacketSize'].agg(packet_size_mean='mean', packet_size_var='var')
+
+    # Count the events of each window in one dense bincount over (window, event code);
+    # '& 3' sends code -1 to the discard slot without a branch
+    window_ids = grouped.ngroup().to_numpy()
+    event_codes = network_df['EventType'].cat.codes.to_numpy() & 3
+    event_counts = np.bincount(window_ids * EVENT_SLOTS + event_codes,
+                               minlength=len(aggregated_df) * EVENT_SLOTS).reshape(-1, EVENT_SLOTS)
+    for slot, column in enumerate(PACKET_COUNT_COLUMNS):
+        aggregated_df.insert(slot, column, event_counts[:, slot])
+
+    # Fill in missing timestamps for every node with a single reindex over the
+    # (Timestamp, NodeID) grid, forward-filling each node from its own history
     if not aggregated_df.empty:
-        min_timestamp = int(aggregated_df['Timestamp'].min())
-        max_timestamp = int(aggregated_df['Timestamp'].max())
+        timestamps = aggregated_df.index.get_level_values('Timestamp')
+        node_ids = aggregated_df.index.get_level_values('NodeID').unique().sort_values()
+        full_index = pd.MultiIndex.from_product(
+            [range(int(timestamps.min()), int(timestamps.max()) + 1), node_ids],
+            names=['Timestamp', 'NodeID']
+        )
+        aggregated_df = aggregated_df.reindex(full_index)
+        aggregated_df = aggregated_df.groupby(level='NodeID').ffill()
+    aggregated_df = aggregated_df.reset_index()
 
-        # Create a DataFrame to ensure all millisecond timestamps are present
-        all_timestamps = pd.DataFrame({'Timestamp': range(min_timestamp, max_timestamp + 1)})
-        aggregated_df = pd.merge(all_timestamps, aggregated_df, on='Timestamp', how='left')
-        aggregated_df.fillna(method='ffill', inplace=True)
+    # The gap fill turns the packet counts into floats; keep them as (nullable)
+    # integers so the CSV writer formats ints and the outputs stay compact
+    aggregated_df = aggregated_df.astype(dict.fromkeys(PACKET_COUNT_COLUMNS, 'Int64'))
 
     # Save the granular aggregated data to a CSV
     aggregated_df.to_csv(output_file_granular, index=False)
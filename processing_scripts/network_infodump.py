@@ -1,63 +1,54 @@
 import re
-import csv
+import mmap
+import os
+import numpy as np
+import pandas as pd
+
+# Single regex for the packet events in the NS3 trace file: '+' lines must be
+# Enqueue, '-' lines Dequeue and 'd' lines PhyRxDrop. The optional trailing group
+# picks up the packet size metadata (last 'Payload Length' on the line).
+PACKET_EVENT_PATTERN = re.compile(
+    rb'^(?:(?P<sent>\+)|(?P<recv>-)|d)[ \t]+(?P<ts>\d+\.\d+)[ \t]+/NodeList/(?P<nid>\d+)/'
+    rb'(?=.*(?(sent)Enqueue|(?(recv)Dequeue|PhyRxDrop)))'
+    rb'(?:.*Payload Length (?P<sz>\d+))?',
+    re.MULTILINE
+)
+
+# Approximate amount of trace text matched and written per batch
+TRACE_BATCH_BYTES = 64 * 1024 * 1024
+
+# Build the output rows for one batch of (sent, recv, ts, nid, sz) regex matches
+def packet_batch_frame(matches):
+    # Convert the byte fields column-wise in NumPy; empty groups are b''
+    fields = np.array(matches, dtype=np.bytes_).reshape(-1, 5)
+    event_codes = np.where(fields[:, 0] != b'', 0, np.where(fields[:, 1] != b'', 1, 2)).astype(np.int8)
+    has_size = fields[:, 4] != b''
+    packet_sizes = np.zeros(len(fields), dtype=np.int32)
+    packet_sizes[has_size] = fields[has_size, 4].astype(np.int32)
+
+    return pd.DataFrame({
+        'Timestamp': fields[:, 2].astype(np.float64),
+        'NodeID': fields[:, 3].astype(np.int32),
+        'EventType': pd.Categorical.from_codes(event_codes, categories=['sent', 'received', 'dropped']),
+        'PacketSize': pd.arrays.IntegerArray(packet_sizes, ~has_size)
+    })
 
 def parse_ns3_trace(trace_file_path, output_csv_path):
-    # Regex patterns for different packet events in the NS3 trace file
-    packet_sent_pattern = re.compile(r'^\+\s+(\d+\.\d+)\s+/NodeList/(\d+)/.*Enqueue')
-    packet_recv_pattern = re.compile(r'^\-\s+(\d+\.\d+)\s+/NodeList/(\d+)/.*Dequeue')
-    packet_drop_pattern = re.compile(r'^d\s+(\d+\.\d+)\s+/NodeList/(\d+)/.*PhyRxDrop')
-    
-    # Metadata extraction (e.g., packet size, protocol, sequence numbers, etc.)
-    metadata_pattern = re.compile(r'.*Payload Length (\d+).*')
-
-    parsed_packets = []
-
-    with open(trace_file_path, 'r') as trace_file:
-        for line_number, line in enumerate(trace_file, start=1):
-            sent_match = packet_sent_pattern.search(line)
-            recv_match = packet_recv_pattern.search(line)
-            drop_match = packet_drop_pattern.search(line)
-
-            packet_metadata = None
-            if "Payload Length" in line:
-                metadata_match = metadata_pattern.search(line)
-                if metadata_match:
-                    packet_metadata = int(metadata_match.group(1))
-
-            if sent_match:
-                timestamp = float(sent_match.group(1))
-                node_id = int(sent_match.group(2))
-                parsed_packets.append({
-                    'Timestamp': timestamp,
-                    'NodeID': node_id,
-                    'EventType': 'sent',
-                    'PacketSize': packet_metadata
-                })
-            elif recv_match:
-                timestamp = float(recv_match.group(1))
-                node_id = int(recv_match.group(2))
-                parsed_packets.append({
-                    'Timestamp': timestamp,
-                    'NodeID': node_id,
-                    'EventType': 'received',
-                    'PacketSize': packet_metadata
-                })
-            elif drop_match:
-                timestamp = float(drop_match.group(1))
-                node_id = int(drop_match.group(2))
-                parsed_packets.append({
-                    'Timestamp': timestamp,
-                    'NodeID': node_id,
-                    'EventType': 'dropped',
-                    'PacketSize': packet_metadata
-                })
-
-    # Writing parsed packet data to a CSV file
-    csv_columns = ['Timestamp', 'NodeID', 'EventType', 'PacketSize']
-    with open(output_csv_path, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
-        writer.writeheader()
-        writer.writerows(parsed_packets)
+    # Write the header, then stream the trace through the regex in line-aligned
+    # batches so memory use does not grow with the trace size
+    packet_batch_frame([]).to_csv(output_csv_path, index=False)
+
+    if os.path.getsize(trace_file_path) > 0:
+        with open(trace_file_path, 'rb') as trace_file, \
+             mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ) as trace_map:
+            batch_start = 0
+            while batch_start < len(trace_map):
+                batch_end = trace_map.find(b'\n', batch_start + TRACE_BATCH_BYTES)
+                batch_end = len(trace_map) if batch_end == -1 else batch_end + 1
+                matches = PACKET_EVENT_PATTERN.findall(trace_map, batch_start, batch_end)
+                if matches:
+                    packet_batch_frame(matches).to_csv(output_csv_path, mode='a', header=False, index=False)
+                batch_start = batch_end
 
     print(f"Parsed network trace data has been exported to '{output_csv_path}'.")
 
@@ -21,9 +21,22 @@ print(df.columns)
 smartmeter_data = df[[col for col in df.columns if "SmartMeter" in col]]
 phasor_data = df[[col for col in df.columns if "Phasor" in col]]
 
+# Measurement fields reported by each device type, in output column order
+SMARTMETER_FIELDS = ['VA', 'VB', 'VC', 'SPA', 'SPB', 'SPC']
+PHASOR_FIELDS = ['VA', 'IA', 'VB', 'IB', 'VC', 'IC']
+EVENT_COLUMNS = {'Normal': 'Event_Normal', 'Fault': 'Event_Fault',
+                 'GeneratorTrip': 'Event_GeneratorTrip', 'LoadChange': 'Event_LoadChange'}
+
+# Split a column of (magnitude, phase) tuples into two columns
+def split_phasor_pairs(pairs):
+    present = pairs.notna()
+    split = pd.DataFrame(pairs[present].tolist(), index=pairs.index[present], columns=[0, 1])
+    split = split.reindex(pairs.index)
+    return split[0], split[1]
+
 # Function to parse device data
 def parse_device_data(device_data, device_type):
-    parsed_data = []
+    frames = []
     print(f"\n--- Parsing {device_type} Data ---")
     for col in device_data.columns:
         print(f"Processing Device: {col}")
@@ -33,76 +46,52 @@ def parse_device_data(device_data, device_type):
             time_data = device_data[col].iloc[1] if len(device_data[col]) > 1 else None
             event_state_data = device_data[col].iloc[2] if len(device_data[col]) > 2 else None
 
-            # Loop through the available data
-            if isinstance(value_data, (list, np.ndarray)) and isinstance(time_data, (list, np.ndarray)):
-                for i, (value, time) in enumerate(zip(value_data, time_data)):
-                    if isinstance(value, dict):
-                        # Extract relevant fields based on device type
-                        if device_type == "SmartMeter":
-                            va = value.get('VA', None)
-                            vb = value.get('VB', None)
-                            vc = value.get('VC', None)
-                            spa = value.get('SPA', None)
-                            spb = value.get('SPB', None)
-                            spc = value.get('SPC', None)
-                        elif device_type == "Phasor":
-                            va = value.get('VA', (None, None))[0]
-                            va_phase = value.get('VA', (None, None))[1]
-                            ia = value.get('IA', (None, None))[0]
-                            ia_phase = value.get('IA', (None, None))[1]
-                            vb = value.get('VB', (None, None))[0]
-                            vb_phase = value.get('VB', (None, None))[1]
-                            ib = value.get('IB', (None, None))[0]
-                            ib_phase = value.get('IB', (None, None))[1]
-                            vc = value.get('VC', (None, None))[0]
-                            vc_phase = value.get('VC', (None, None))[1]
-                            ic = value.get('IC', (None, None))[0]
-                            ic_phase = value.get('IC', (None, None))[1]
-
-                        # Parse event_state if available
-                        if isinstance(event_state_data, (list, np.ndarray)) and len(event_state_data) > i:
-                            event_state = event_state_data[i]
-                            if isinstance(event_state, dict):
-                                event_normal = int(event_state.get('Normal', False))
-                                event_fault = int(event_state.get('Fault', False))
-                                event_generator_trip = int(event_state.get('GeneratorTrip', False))
-                                event_load_change = int(event_state.get('LoadChange', False))
-                            else:
-                                event_normal = event_fault = event_generator_trip = event_load_change = None
-                        else:
-                            event_normal = event_fault = event_generator_trip = event_load_change = None
-
-                        # Append parsed data
-                        if device_type == "SmartMeter":
-                            parsed_data.append({
-                                'Timestamp': time,
-                                'MeterID': value.get('IDT', None),
-                                'VA': va, 'VB': vb, 'VC': vc,
-                                'SPA': spa, 'SPB': spb, 'SPC': spc,
-                                'Event_Normal': event_normal,
-                                'Event_Fault': event_fault,
-                                'Event_GeneratorTrip': event_generator_trip,
-                                'Event_LoadChange': event_load_change
-                            })
-                        elif device_type == "Phasor":
-                            parsed_data.append({
-                                'Timestamp': time,
-                                'PhasorID': value.get('IDT', None),
-                                'VA_Magnitude': va, 'VA_Phase': va_phase,
-                                'IA_Magnitude': ia, 'IA_Phase': ia_phase,
-                                'VB_Magnitude': vb, 'VB_Phase': vb_phase,
-                                'IB_Magnitude': ib, 'IB_Phase': ib_phase,
-                                'VC_Magnitude': vc, 'VC_Phase': vc_phase,
-                                'IC_Magnitude': ic, 'IC_Phase': ic_phase,
-                                'Event_Normal': event_normal,
-                                'Event_Fault': event_fault,
-                                'Event_GeneratorTrip': event_generator_trip,
-                                'Event_LoadChange': event_load_change
-                            })
+            if not (isinstance(value_data, (list, np.ndarray)) and isinstance(time_data, (list, np.ndarray))):
+                continue
+
+            # Only samples holding a measurement dict produce a row
+            rows = [i for i in range(min(len(value_data), len(time_data))) if isinstance(value_data[i], dict)]
+            if not rows:
+                continue
+            values = pd.DataFrame.from_records([value_data[i] for i in rows])
+
+            # Extract relevant fields based on device type; unreported fields are float NaN
+            timestamps = np.asarray(time_data, dtype=float)[rows]
+            missing = np.full(len(rows), np.nan)
+            if device_type == "SmartMeter":
+                columns = {'Timestamp': timestamps, 'MeterID': values.get('IDT')}
+                for field in SMARTMETER_FIELDS:
+                    columns[field] = values[field] if field in values else missing
+            elif device_type == "Phasor":
+                columns = {'Timestamp': timestamps, 'PhasorID': values.get('IDT')}
+                for field in PHASOR_FIELDS:
+                    if field in values:
+                        magnitude, phase = split_phasor_pairs(values[field])
+                    else:
+                        magnitude = phase = missing
+                    columns[f'{field}_Magnitude'] = magnitude
+                    columns[f'{field}_Phase'] = phase
+            else:
+                continue
+
+            # Parse event_state if available; rows without a state dict get missing flags
+            if isinstance(event_state_data, (list, np.ndarray)):
+                states = [event_state_data[i] if i < len(event_state_data) else None for i in rows]
+            else:
+                states = [None] * len(rows)
+            has_state = np.array([isinstance(state, dict) for state in states], dtype=bool)
+            events = pd.DataFrame([state if isinstance(state, dict) else {} for state in states])
+            events = events.reindex(columns=list(EVENT_COLUMNS))
+            flags = (events.notna() & events.astype(bool)).to_numpy(dtype=np.int8)
+            for i, column in enumerate(EVENT_COLUMNS.values()):
+                columns[column] = pd.arrays.IntegerArray(flags[:, i].copy(), ~has_state)
+
+            frames.append(pd.DataFrame(columns))
         except Exception as e:
             print(f"  Error processing column {col}: {e}")
 
-    return pd.DataFrame(parsed_data)
+    # One concatenation of all device frames, without an extra block copy
+    return pd.concat(frames, ignore_index=True, copy=False) if frames else pd.DataFrame()
 
 # Parse SmartMeter and Phasor data
 parsed_smartmeter_data = parse_device_data(smartmeter_data, "SmartMeter")
@@ -13,42 +13,51 @@ Adapted and updated by Meaghan White in 2024.
 import os
 import sys
 import csv
-import mosaik
-import mosaik.util
+import math
+import json
+import tempfile
 import argparse
+import functools
 from datetime import datetime
 from pathlib import Path
 import time
 
 import numpy as np
 
-# Add OpenDSS directory to sys.path
-open_dss_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../OpenDSS'))
-if open_dss_path not in sys.path:
-    sys.path.insert(0, open_dss_path)
+# Add OpenDSS directory to sys.path when run as the simulation script
+if __name__ == '__main__':
+    open_dss_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../OpenDSS'))
+    if open_dss_path not in sys.path:
+        sys.path.insert(0, open_dss_path)
 
 #--- Performance test for Mosaik 2 vs Mosaik 3
 Mosaik_2 = False
 
 #--- Base Directory
-BASE_DIR = os.getcwd()
-BASE_DIR = str((Path(BASE_DIR)).parent) + "/"
+BASE_DIR = Path.cwd().parent
+
+#--- Directory of this script, input files are resolved against it
+SCRIPT_DIR = Path(__file__).resolve().parent
 
 #--- OpenDSS warp scripts directory
-DSS_EXE_PATH = BASE_DIR + 'SmartGridMain/'
+DSS_EXE_PATH = BASE_DIR / 'SmartGridMain'
 
 # IEEE33
 TOPO_RPATH_FILE = 'IEEE33/outfile.dss'
 NWL_RPATH_FILE  = 'IEEE33/IEEE33_NodeWithLoadFull.csv'
 ILPQ_RPATH_FILE = 'IEEE33/IEEE33_InelasticLoadPQ.csv'
 DEVS_RPATH_FILE = 'IEEE33/IEEE33_Devices_RIDE.csv'
+YMAT_RPATH_FILE = 'IEEE33/IEEE33_YMatrix.npy'
+TOPO_FILE = str(DSS_EXE_PATH / TOPO_RPATH_FILE)
+NWL_FILE  = str(DSS_EXE_PATH / NWL_RPATH_FILE)
+ILPQ_FILE = str(DSS_EXE_PATH / ILPQ_RPATH_FILE)
 
 #--- NS3 executables and library directory
-NS3_EXE_PATH = BASE_DIR + 'NS3Mosaik'
-NS3_LIB_PATH = BASE_DIR + 'ns-allinone-3.33/ns-3.33/build/lib'
+NS3_EXE_PATH = BASE_DIR / 'NS3Mosaik'
+NS3_LIB_PATH = str(BASE_DIR / 'ns-allinone-3.33/ns-3.33/build/lib')
 
 # IEEE33
-JSON_RPATH_FILE = DSS_EXE_PATH + 'IEEE33/gen_nodes.json'
+JSON_RPATH_FILE = str(DSS_EXE_PATH / 'IEEE33/gen_nodes.json')
 
 #--- Simulators configuration
 if Mosaik_2:
@@ -63,8 +72,8 @@ if Mosaik_2:
             'python': 'simulator_pflow_2:PFlowSim',
         },
         'PktNetSim': {
-            'cmd': NS3_EXE_PATH + '/NS3MosaikSim %(addr)s --enablePcap',
-            'cwd': Path( os.path.abspath( os.path.dirname( NS3_EXE_PATH ) ) ),
+            'cmd': str(NS3_EXE_PATH / 'NS3MosaikSim') + ' %(addr)s --enablePcap',
+            'cwd': NS3_EXE_PATH.parent,
             'env': {
                     'LD_LIBRARY_PATH': NS3_LIB_PATH,
                     'NS_LOG': "SmartgridNs3Main=all",
@@ -83,8 +92,8 @@ else:
             'python': 'simulator_pflow_3:PFlowSim',
         },
         'PktNetSim': {
-            'cmd': NS3_EXE_PATH + '/NS3MosaikSim %(addr)s',
-            'cwd': Path( os.path.abspath( os.path.dirname( NS3_EXE_PATH ) ) ),
+            'cmd': str(NS3_EXE_PATH / 'NS3MosaikSim') + ' %(addr)s',
+            'cwd': NS3_EXE_PATH.parent,
             'env': {
                     'LD_LIBRARY_PATH': NS3_LIB_PATH,
                     'NS_LOG': "SmartgridNs3Main=all",
@@ -100,10 +109,17 @@ END_TIME =  100	#  0.1 secs -- 1000 for 1, 10000 for 10, etc
 
 #-- se period in ms
 num_state_estimations = 10
-calc_se_period = int(END_TIME / num_state_estimations)
-calc_acc_period = int(calc_se_period / 10)
+# Floor at 1 ms so a short END_TIME cannot produce a zero period;
+# the accumulation period follows se_period / 10 once arguments are parsed
+calc_se_period = max(1, int(END_TIME / num_state_estimations))
 
-print("SE Period: {} \nAccumulation period: {}".format(calc_se_period, calc_acc_period))
+#--- DSE per-unit bases as plain floats
+BASE_S = 100e3 / 3                  # single phase power base
+BASE_V = 12.66e3 / math.sqrt(3)     # single phase voltage base
+
+#--- Initial data for time-shifted connections, shared by all of them
+#--- (mosaik only reads it and requires a plain dict)
+INITIAL_DATA_NONE = {'v': [None], 't': [None]}
 
 #--- Application connection links
 appconLinks = {}
@@ -111,6 +127,12 @@ appconLinks = {}
 #--- Sensors and actuators parameters
 devParams = {}
 
+#--- Sensors and actuators parameters grouped by device type
+devsByType = {}
+
+#--- Sensors and actuators whose data goes through ns-3 (no probers or self-loops)
+remoteDevs = {}
+
 #--- Mosaik Configuration
 MOSAIK_CONFIG = {
     'execution_graph': False,
@@ -119,55 +141,127 @@ MOSAIK_CONFIG = {
     'stop_timeout' : 10,   # seconds    
 }
 
+#--- Actives rows, one array per column; set by readActives
+activesTapCols = ()
+
+#--- Layout version of the rows cached by readDevices; bump it whenever
+#--- the parsed row dicts change so older caches are re-parsed
+DEVS_CACHE_VERSION = 2
+
+#--- Absolute path of an input file given relative to this script
+@functools.lru_cache(maxsize=None)
+def resolvePath(relpath):
+    return str((SCRIPT_DIR / relpath).resolve())
+
 #--- Load Simulation devices and configurations
-def readDevices(devsfile):
-    
-    global devParams
+def readDevices(devsfile, use_cache=True):
     
-    current_directory = os.path.dirname(os.path.realpath(__file__))
-    pathToFile = os.path.abspath(
-        os.path.join(current_directory, devsfile)
-    )
+    pathToFile = resolvePath(devsfile)
     if not os.path.isfile(pathToFile):
         print('File Actives does not exist: ' + pathToFile)
         sys.exit()
     else:
-        with open(pathToFile, 'r') as csvFile:
-            csvobj = csv.reader(csvFile)
-            next(csvobj)
-            for rows in csvobj:
-                if(len(rows) == 11):
-                    instance = rows[0] + "_" +  rows[1] + "-" + rows[2] \
-                                + '.' + rows[3] + '.' + rows[4]
-                    devParams[instance] = {}
-                    devParams[instance]['device']      = rows[0]
-                    devParams[instance]['src']         = rows[1]
-                    devParams[instance]['dst']         = rows[2]
-                    devParams[instance]['cidx']        = rows[3]
-                    devParams[instance]['didx']        = rows[4]
-                    devParams[instance]['period']      = rows[5]
-                    devParams[instance]['error']       = rows[6]
-                    devParams[instance]['cktElement']  = rows[7]
-                    devParams[instance]['cktTerminal'] = rows[8]
-                    devParams[instance]['cktPhase']    = rows[9]
-                    devParams[instance]['cktProperty'] = rows[10] 
+        #--- Parsed rows are cached next to the devices file until it changes;
+        #--- the sidecar is plain JSON so loading it never runs code
+        cache_path = pathToFile + '.cache.json'
+        params = None
+        if use_cache and os.path.isfile(cache_path) \
+                and os.path.getmtime(cache_path) >= os.path.getmtime(pathToFile):
+            #--- an unreadable or truncated cache is re-parsed from the CSV
+            try:
+                with open(cache_path, 'r') as cacheFile:
+                    cached = json.load(cacheFile)
+                if cached.get('version') == DEVS_CACHE_VERSION:
+                    params = cached['rows']
+            except (OSError, ValueError, KeyError, AttributeError):
+                params = None
+        if params is None:
+            params = {}
+            # Device files hold no quoted fields, so skip quote handling
+            with open(pathToFile, 'r', newline='', buffering=1 << 20) as csvFile:
+                csvobj = csv.reader(csvFile, quoting=csv.QUOTE_NONE)
+                next(csvobj)
+                for rows in csvobj:
+                    if(len(rows) == 11):
+                        device, src, dst, cidx, didx = rows[:5]
+                        loop_eid = src + '-' + dst + '.' + cidx
+                        instance = device + '_' + loop_eid + '.' + didx
+                        row = params[instance] = {
+                            'device':      device,
+                            'src':         src,
+                            'dst':         dst,
+                            'cidx':        cidx,
+                            'didx':        didx,
+                            'period':      rows[5],
+                            'error':       rows[6],
+                            'cktElement':  rows[7],
+                            'cktTerminal': rows[8],
+                            'cktPhase':    rows[9],
+                            'cktProperty': rows[10],
+                        }
+                        #--- Entity eids, built once here instead of in create_scenario
+                        if device == 'Actuator':
+                            # One control loop has only one controller/actuator
+                            row['eid']             = 'Actuator_' + dst + '.' + cidx
+                            row['controller_eid']  = 'Control_' + loop_eid
+                            row['transporter_eid'] = 'Transp_' + loop_eid
+                        else:
+                            if device == 'Prober':
+                                row['eid'] = 'Prober_' + src + '.' + cidx + '.' + didx
+                            else:
+                                row['eid'] = instance
+                            row['transporter_eid'] = 'Transp_' + loop_eid + '.' + didx
+            if use_cache:
+                #--- best effort: write a temp file and move it into place so an
+                #--- interrupted run never leaves a partial cache; skip read-only dirs
+                try:
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+                    try:
+                        with os.fdopen(fd, 'w') as cacheFile:
+                            json.dump({'version': DEVS_CACHE_VERSION, 'rows': params}, cacheFile)
+                        os.replace(tmp_path, cache_path)
+                    except BaseException:
+                        os.unlink(tmp_path)
+                        raise
+                except OSError:
+                    pass
+        devParams.update(params)
+        for instance, row in params.items():
+            row['self_loop'] = row['src'] == row['dst']
+            devsByType.setdefault(row['device'], {})[instance] = row
+        remoteDevs.clear()
+        for device, bucket in devsByType.items():
+            if device == 'Prober': continue
+            for instance, row in bucket.items():
+                if not row['self_loop']:
+                    remoteDevs[instance] = row
 
 def readActives(actives_tap):
 
-    global activesTap
+    global activesTap, activesTapCols
 
-    current_directory = os.path.dirname(os.path.realpath(__file__))
-    pathToFile = os.path.abspath(
-        os.path.join(current_directory, actives_tap)
-    )
+    pathToFile = resolvePath(actives_tap)
     if not os.path.isfile(pathToFile):
         print('File does not exist: ' + pathToFile)
         sys.exit()
     else:
         with open(pathToFile, 'r') as csvFile:
             csvobj = csv.reader(csvFile)
-            activesTap = {(rows[0], rows[1], rows[2], rows[3], rows[4]) for rows in csvobj}
-        csvFile.close()
+            rows_list = [tuple(rows[:5]) for rows in csvobj]
+        # Exact-tuple lookups keep the set; column filters use one array per field
+        activesTap = set(rows_list)
+        activesTapCols = tuple(np.array(col, dtype=str) for col in zip(*rows_list)) \
+                         if rows_list else tuple(np.array([], dtype=str) for _ in range(5))
+
+#--- Boolean mask over the actives rows matching every given column value
+def active_mask(*values):
+    if not activesTapCols:
+        return np.zeros(0, dtype=bool)
+    mask = np.ones(len(activesTapCols[0]), dtype=bool)
+    for col, value in zip(activesTapCols, values):
+        if value is not None:
+            mask &= (col == value)
+    return mask
 
 def main():
     #--- Process input arguments
@@ -176,16 +270,32 @@ def main():
     parser.add_argument( '--devs_file', type=str, help='devices connections file', default = DEVS_RPATH_FILE )
     parser.add_argument( '--random_seed', type=int, help='ns-3 random generator seed', default=1 )
     parser.add_argument( '--influxdb', action='store_true')
+    parser.add_argument( '--no-cache', dest='use_cache', action='store_false', help='always re-parse the devices file' )
+    parser.add_argument( '--verbose', action='store_true', help='print every connection made' )
     parser.set_defaults(influxdb=False)
     parser.add_argument('--enable_events', type=int, default=0, help='0=baseline physical, 1=events/impairments physically')
     parser.add_argument('--link_delay', type=str, default="0.5ms", help='Link delay e.g. 0.5ms, 1ms, 5ms, 10ms')
     parser.add_argument('--link_error_rate', type=str, default="0.0001", help='Link error rate e.g. 0.0001 or 0.01')
+    parser.add_argument('--se_period', type=int, default=calc_se_period, help='State estimation period in ms')
+    parser.add_argument('--acc_period', type=int, default=None, help='DSE accumulation period in ms (default: se_period / 10)')
+    parser.add_argument('--ymat_abspath', action='store_true', help='pass DSESim the YMatrix path resolved against this script directory')
+    parser.add_argument('--flush_stdout', action='store_true', help='flush the power flow simulator output after init, create and finalize')
 
     args = parser.parse_args()
+    args.se_period = max(1, args.se_period)
+    if args.acc_period is None:
+        args.acc_period = max(1, args.se_period // 10)
+    args.acc_period = max(1, args.acc_period)
+    if args.ymat_abspath and not os.path.isfile(resolvePath(YMAT_RPATH_FILE)):
+        print('File YMatrix does not exist: ' + resolvePath(YMAT_RPATH_FILE))
+        sys.exit()
+    print("SE Period: {} \nAccumulation period: {}".format(args.se_period, args.acc_period))
     print( 'Starting simulation with args: {0}'.format( vars( args ) ) )
     
 
-    readDevices(args.devs_file)
+    readDevices(args.devs_file, args.use_cache)
+    # mosaik is only needed to run the simulation, not to import this module
+    import mosaik
     world = mosaik.World( sim_config=SIM_CONFIG, mosaik_config=MOSAIK_CONFIG, debug=False )
     create_scenario( world, args )
     
@@ -193,27 +303,30 @@ def main():
 
 
 def  create_scenario( world, args ):
+    import mosaik.util
+
     #---
     #--- Simulators configuration
     #---
 
     if Mosaik_2:
         pflowsim    = world.start('PFlowSim',
-                              topofile = DSS_EXE_PATH + TOPO_RPATH_FILE,
-                              nwlfile  = DSS_EXE_PATH + NWL_RPATH_FILE,
-                              ilpqfile = DSS_EXE_PATH + ILPQ_RPATH_FILE,
+                              topofile = TOPO_FILE,
+                              nwlfile  = NWL_FILE,
+                              ilpqfile = ILPQ_FILE,
                               step_size = 1,
                               loadgen_interval = 80,
                               verbose = 0)    
     else:
         pflowsim    = world.start('PFlowSim',
-                              topofile = DSS_EXE_PATH + TOPO_RPATH_FILE,
-                              nwlfile  = DSS_EXE_PATH + NWL_RPATH_FILE,
-                              ilpqfile = DSS_EXE_PATH + ILPQ_RPATH_FILE,
+                              topofile = TOPO_FILE,
+                              nwlfile  = NWL_FILE,
+                              ilpqfile = ILPQ_FILE,
                             #   loadgen_interval = 80, # IEEE13
                               loadgen_interval = 1000, # IEEE33
                               event_interval = 300, 
                               enable_events = args.enable_events, # 0 for baseline, 1 for events
+                              flush_stdout = int(args.flush_stdout),
                               verbose = 0)    
   
 
@@ -253,158 +366,102 @@ def  create_scenario( world, args ):
     #--- Simulators Instances configuration
     #---
 
-    # Declaring instance lists
-    sensors = []
-    controllers = []
-    actuators = []
-    transporters = []
+    # Declaring instance indexes (eid -> entity); probers are never looked up
+    sensors = {}
+    controllers = {}
+    actuators = {}
+    transporters = {}
+    # (server, control loop) -> transporters delivering to that controller
+    transporter_by_server_cloop = {}
     probers = []
-    smartmeters = []
-    phasors = []
-    created_estimator_conn = []
-    for key in devParams.keys():
-        device          = devParams[key]['device']
-        client          = devParams[key]['src']
-        server          = devParams[key]['dst']
-        control_loop    = devParams[key]['cidx']
-        namespace       = devParams[key]['didx']
-        #--- Sensor instances
-        if (device == 'Sensor'):
-            sensor_instance = device + '_' + client + '-' + server \
-                                + '.' + control_loop + '.' + namespace
-            created_sensor = False
-            for sensor in sensors:
-                if (sensor_instance == sensor.eid):
-                    created_sensor = True
-            if not created_sensor:
-                sensors.append(pflowsim.Sensor(
-                    cktTerminal = devParams[key]['cktTerminal'],
-                    cktPhase = devParams[key]['cktPhase'],
-                    eid =  sensor_instance,
-                    step_size = devParams[key]['period'],
-                    cktElement = devParams[key]['cktElement'], 
-                    error = devParams[key]['error'],
-                    verbose = 0
-                ))
-        elif (device == 'Phasor'):
-            phasor_instance = device + '_' + client + '-' + server \
-                                + '.' + control_loop + '.' + namespace
-            created_phasor = False
-            for phasor in phasors:
-                if (phasor_instance == phasor.eid):
-                    created_phasor = True
-            if not created_phasor:
-                phasors.append(pflowsim.Phasor(
-                    cktTerminal = devParams[key]['cktTerminal'],
-                    cktPhase = devParams[key]['cktPhase'],
-                    eid = phasor_instance, 
-                    step_size = devParams[key]['period'],  
-                    cktElement = devParams[key]['cktElement'], 
-                    error = devParams[key]['error'], 
-                    verbose = 0
-                ))
-        elif (device == "SmartMeter"):
-            smartmeter_instance = device + '_' + client + '-' + server \
-                                + '.' + control_loop + '.' + namespace
-            created_smartmeter = False
-            for smartmeter in smartmeters:
-                if (smartmeter_instance == smartmeter.eid):
-                    created_smartmeter = True
-            if not created_smartmeter:
-                smartmeters.append(pflowsim.Smartmeter(
-                    cktTerminal = devParams[key]['cktTerminal'],
-                    cktPhase = devParams[key]['cktPhase'],
-                    eid = smartmeter_instance, 
-                    step_size = devParams[key]['period'],  
-                    cktElement = devParams[key]['cktElement'], 
-                    error = devParams[key]['error'], 
+    smartmeters = {}
+    phasors = {}
+    created_estimator_conn = set()
+
+    #--- Sensor, Phasor and Smartmeter instances
+    for device, model, instances in (('Sensor',     pflowsim.Sensor,     sensors),
+                                     ('Phasor',     pflowsim.Phasor,     phasors),
+                                     ('SmartMeter', pflowsim.Smartmeter, smartmeters)):
+        for params in devsByType.get(device, {}).values():
+            instance = params['eid']
+            if instance not in instances:
+                instances[instance] = model(
+                    cktTerminal = params['cktTerminal'],
+                    cktPhase = params['cktPhase'],
+                    eid = instance,
+                    step_size = params['period'],
+                    cktElement = params['cktElement'],
+                    error = params['error'],
                     verbose = 0
-                ))
-        #--- Controller and Actuator instances for tap control
-        elif (device == 'Actuator'):
-            # Ignore namespace as one control loop has only one controller/actuator
-            controller_instance = 'Control_' + client + '-' + server \
-                                + '.' + control_loop
-            created_control = False
-            for controller in controllers:
-                if (controller_instance == controller.eid):
-                    created_control = True
-            if not created_control:
-                controllers.append(
-                    controlsim.RangeControl(
-                        eid      = controller_instance,
-                        vset    = 2178,
-                        bw      = 13.6125,
-                        tdelay  = 60,
-                        control_delay = devParams[key]['period']
-                    ))
-            created_actuator = False
-            actuator_instance = 'Actuator_' + server \
-                                + '.' + control_loop
-            for actuator in actuators:
-                if (actuator_instance == actuator.eid):
-                    created_actuator = True
-            if not created_actuator:
-                actuators.append(pflowsim.Actuator(
-                    cktTerminal = devParams[key]['cktTerminal'],
-                    cktPhase = devParams[key]['cktPhase'],
-                    eid = actuator_instance,
-                    step_size = devParams[key]['period'],
-                    cktElement = devParams[key]['cktElement'], 
-                    error = devParams[key]['error'],
-                    verbose = 0
-                ))
-
-        #--- Probers do not need transporters
-        if (device == 'Prober'):
-            prober_instance = 'Prober_' + client + '.' \
-                            + control_loop + '.' + namespace
-            probers.append(pflowsim.Prober(
-                cktTerminal = devParams[key]['cktTerminal'],
-                cktPhase = devParams[key]['cktPhase'],
-                eid = prober_instance,
-                step_size = devParams[key]['period'],
-                cktElement = devParams[key]['cktElement'],
-                error = devParams[key]['error'],
+                )
+
+    #--- Controller and Actuator instances for tap control
+    for params in devsByType.get('Actuator', {}).values():
+        # Ignore namespace as one control loop has only one controller/actuator
+        controller_instance = params['controller_eid']
+        actuator_instance   = params['eid']
+        if controller_instance not in controllers:
+            controllers[controller_instance] = controlsim.RangeControl(
+                    eid      = controller_instance,
+                    vset    = 2178,
+                    bw      = 13.6125,
+                    tdelay  = 60,
+                    control_delay = params['period']
+                )
+        if actuator_instance not in actuators:
+            actuators[actuator_instance] = pflowsim.Actuator(
+                cktTerminal = params['cktTerminal'],
+                cktPhase = params['cktPhase'],
+                eid = actuator_instance,
+                step_size = params['period'],
+                cktElement = params['cktElement'],
+                error = params['error'],
                 verbose = 0
-            ))
-        else:
-            #--- Transporter instances (Pktnet)
-            #--- Does not make sense to transfer data through ns-3
-            #--- to construct self-loops (source = destination)
-            if client == server: continue
-            created_transporter = False
-            if (device == 'Actuator'):
-                transporter_instance = 'Transp_' + client + '-' + server \
-                                        + '.' + control_loop
-            else:
-                transporter_instance = 'Transp_' + client + '-' + server \
-                                        + '.' + control_loop + '.' + namespace
-            for transporter in transporters:
-                if (transporter_instance == transporter.eid):
-                    created_transporter = True            
-            if not created_transporter:
-                transporters.append(pktnetsim.Transporter(
-                    src=client,
-                    dst=server,
-                    eid=transporter_instance
-                ))
-
+            )
+
+    #--- Probers do not need transporters
+    for params in devsByType.get('Prober', {}).values():
+        probers.append(pflowsim.Prober(
+            cktTerminal = params['cktTerminal'],
+            cktPhase = params['cktPhase'],
+            eid = params['eid'],
+            step_size = params['period'],
+            cktElement = params['cktElement'],
+            error = params['error'],
+            verbose = 0
+        ))
+
+    #--- Transporter instances (Pktnet)
+    #--- Does not make sense to transfer data through ns-3
+    #--- to construct self-loops (source = destination)
+    #--- One spec per transporter eid, created together below; mosaik's
+    #--- Model.create(num, ...) cannot give each entity its own src/dst/eid
+    transporter_specs = {}
+    for params in remoteDevs.values():
+        transporter_specs.setdefault(params['transporter_eid'],
+                                     (params['src'], params['dst'], params['cidx']))
+    for transporter_instance, (client, server, control_loop) in transporter_specs.items():
+        transporters[transporter_instance] = pktnetsim.Transporter(
+            src=client,
+            dst=server,
+            eid=transporter_instance
+        )
+        transporter_by_server_cloop.setdefault((server, control_loop), []).append(
+            transporters[transporter_instance])
 
-        
     #--- DSE instance
     dsesim = estimator.DSESim(
         idt = 1, 
-        ymat_file = 'IEEE33/IEEE33_YMatrix.npy', 
+        ymat_file = resolvePath(YMAT_RPATH_FILE) if args.ymat_abspath else YMAT_RPATH_FILE,
         devs_file = DEVS_RPATH_FILE,
-        acc_period = calc_acc_period, # what is this, should it change based on something?
+        acc_period = args.acc_period, # what is this, should it change based on something?
         max_iter = 5, 
         threshold = 0.001,
-        baseS = 100e3/3,            # single phase power base
-        baseV = 12.66e3/np.sqrt(3),
+        baseS = BASE_S,             # single phase power base
+        baseV = BASE_V,
         baseNode = 1,               # single phase voltage base
         basePF = 0.99,
-        se_period = calc_se_period, # state estimation period in ms -- should we make this equal to the sampling frequency of the meters etc? i have messed with the sample period numbers in device file!
+        se_period = args.se_period, # state estimation period in ms -- should we make this equal to the sampling frequency of the meters etc? i have messed with the sample period numbers in device file!
         pseudo_loads = 'IEEE33/loadPseudo.mat',
         se_result = 'IEEE33/wls_results.mat' # save the wls results
     )
@@ -423,173 +480,158 @@ def  create_scenario( world, args ):
         #--- InfluxDB instance
         inflxudb_connection = inflxudb.InfluxDB_Connection()
         #--- Sensors to influxdb
-        mosaik.util.connect_many_to_one(world, sensors, inflxudb_connection, 'v', 't')
-        for sensor in sensors:
-            print('Connect', sensor.eid, 'to', inflxudb_connection.sid)        
-        mosaik.util.connect_many_to_one(world, controllers, inflxudb_connection, 'v', 't')
-        for controller in controllers:
-            print('Connect', controller.eid, 'to', inflxudb_connection.sid)
-        mosaik.util.connect_many_to_one(world, actuators, inflxudb_connection, 'v', 't')
-        for actuator in actuators:
-            print('Connect', actuator.sid, 'to', inflxudb_connection.sid)
+        mosaik.util.connect_many_to_one(world, sensors.values(), inflxudb_connection, 'v', 't')
+        if args.verbose:
+            for sensor in sensors.values():
+                print('Connect', sensor.eid, 'to', inflxudb_connection.sid)
+        mosaik.util.connect_many_to_one(world, controllers.values(), inflxudb_connection, 'v', 't')
+        if args.verbose:
+            for controller in controllers.values():
+                print('Connect', controller.eid, 'to', inflxudb_connection.sid)
+        mosaik.util.connect_many_to_one(world, actuators.values(), inflxudb_connection, 'v', 't')
+        if args.verbose:
+            for actuator in actuators.values():
+                print('Connect', actuator.sid, 'to', inflxudb_connection.sid)
         mosaik.util.connect_many_to_one(world, probers, inflxudb_connection, 'v', 't')
-        for prober in probers:
-            print('Connect', prober.sid, 'to', inflxudb_connection.sid)
+        if args.verbose:
+            for prober in probers:
+                print('Connect', prober.sid, 'to', inflxudb_connection.sid)
 
     #---
     #--- Simulators interconnections
     #---
-    
-    for key in devParams.keys():
-        device          = devParams[key]['device']
-        client          = devParams[key]['src']
-        server          = devParams[key]['dst']
-        control_loop    = devParams[key]['cidx']
-        namespace       = devParams[key]['didx']
-
-        #--- Sensor to PktNet(Transporter)
-        if (device == 'Sensor'):
-            sensor_instance      = device + '_' + client + '-' + server \
-                                    + '.' + control_loop + '.' + namespace
-            transporter_instance = 'Transp_' + client + '-' + server \
-                                    + '.' + control_loop + '.' + namespace
-            for sensor in sensors:
-                if (sensor_instance == sensor.eid):
-                    for transporter in transporters:
-                        if (transporter_instance == transporter.eid):
-                            world.connect(sensor, transporter, 'v', 't')
-                            print('Connect', sensor.eid, 'to', transporter.eid)
-        
-        #--- Phasor to PktNet(Transporter) to Estimator(DSESim)
-        elif (device == 'Phasor'):
-            phasor_instance = device + '_' + client + '-' + server \
-                                    + '.' + control_loop + '.' + namespace
-            transporter_instance = 'Transp_' + client + '-' + server \
-                                    + '.' + control_loop + '.' + namespace
-            #--- Does not make sense to transfer data through ns-3
-            #--- to construct self-loops (source = destination)
-            #--- Connect phasor directly to dsesim
-            if client == server:
-                for phasor in phasors:
-                    if (phasor_instance == phasor.eid):
-                        world.connect(phasor, dsesim, 'v', 't')
-                continue
-
-            for phasor in phasors:
-                if (phasor_instance == phasor.eid):
-                    for transporter in transporters:
-                        if (transporter_instance == transporter.eid):
-                            world.connect(phasor, transporter, 'v', 't')
-                            # print("Connecting {} to {}".format(transporter_instance, phasor_instance))
-                            print('Connect', phasor.eid, 'to', transporter.eid)
-            if transporter_instance not in created_estimator_conn:
-                for transporter in transporters:
-                    if (transporter_instance == transporter.eid):
-                        created_estimator_conn.append(transporter_instance) 
-                        world.connect(transporter, dsesim, 'v', 't')
-                        print('Connect', transporter.eid, 'to', dsesim.eid)
-            
-        #--- Smartmeter to PktNet(Transporter) to DSE(Estimator)
-        elif (device == 'SmartMeter'):
-            smartmeter_instance = device + '_' + client + '-' + server \
-                                    + '.' + control_loop + '.' + namespace
-            transporter_instance = 'Transp_' + client + '-' + server \
-                                    + '.' + control_loop + '.' + namespace
-            for smartmeter in smartmeters:
-                if (smartmeter_instance == smartmeter.eid):
-                    for transporter in transporters:
-                        if (transporter_instance == transporter.eid):
-                            world.connect(smartmeter, transporter, 'v', 't')
-                            print('Connect', smartmeter.eid, 'to', transporter.eid)
-            if transporter_instance not in created_estimator_conn:
-                for transporter in transporters:
-                    if (transporter_instance == transporter.eid):
-                        created_estimator_conn.append(transporter_instance) 
-                        world.connect(transporter, dsesim, 'v', 't')
-                        print('Connect', transporter.eid, 'to', dsesim.eid)
-
-        #--- PktNet(Transporter) to Controller to PktNet(Transporter) to Actuator
-        elif (device == 'Actuator'):
-            controller_instance  = 'Control_' + client + '-' + server \
-                                    + '.' + control_loop
-            actuator_instance = 'Actuator_' + server + '.' + control_loop
-            transporter_instance = 'Transp_' + client + '-' + server \
-                                    + '.' + control_loop
-
-            #--- Controller to PktNet
-            for controller in controllers:
-                if (controller_instance == controller.eid):
-                    for transporter in transporters:
-                        if (transporter_instance == transporter.eid):
-                            world.connect(controller, transporter, 'v', 't')
-                            print('Connect', controller.eid, 'to', transporter.eid)
-        
-            #--- PktNet(Transporter) to Actuator           
-            for actuator in actuators:
-                if (actuator_instance == actuator.eid):
-                    for transporter in transporters:
-                        if (transporter_instance == transporter.eid):
-                            world.connect(transporter, actuator, 'v', 't',
-                                time_shifted=True, initial_data={'v': [None], 't': [None]})
-                            print('Connect', transporter.eid, 'to', actuator.eid)
-
-            #--- PktNet(Transporter) to Controller
-            #--- Find the transporter that needs to connect to this controller
-            for controller in controllers:
-                if (controller_instance == controller.eid):
-                    for transporter in transporters:
-                        # Find server and control loop of transporter
-                        t_server = transporter.eid
-                        t_control_loop = transporter.eid
-                        t_server = t_server.split('_', 1)[1]
-                        t_server = t_server.split('-', 1)[1]
-                        t_server = t_server.split('.', 1)[0]
-                        t_control_loop = t_control_loop.split('.')[1]
-                        print(transporter.eid, " Server: ", t_server, " Control Loop: ", t_control_loop)
-                        if (t_server == client and t_control_loop == control_loop):
-                            world.connect(transporter, controller, 'v', 't',
-                                time_shifted=True, initial_data={'v': [None], 't': [None]})
-                            print('Connect', transporter.eid, 'to', controller.eid)
 
+    #--- Connect each (source, destination) pair with the same attributes
+    def batch_connect(pairs, *attrs, **kwargs):
+        for src, dst in pairs:
+            world.connect(src, dst, *attrs, **kwargs)
+            if args.verbose:
+                print('Connect', src.eid, 'to', dst.eid)
+
+    #--- Device to PktNet(Transporter) pairs and PktNet(Transporter) feeding Estimator(DSESim)
+    device_transporter_pairs = []
+    estimator_transporters = []
+
+    #--- Sensor to PktNet(Transporter)
+    for params in devsByType.get('Sensor', {}).values():
+        sensor_instance      = params['eid']
+        transporter_instance = params['transporter_eid']
+        if sensor_instance in sensors and transporter_instance in transporters:
+            device_transporter_pairs.append((sensors[sensor_instance], transporters[transporter_instance]))
+
+    #--- Phasor to PktNet(Transporter) to Estimator(DSESim)
+    for params in devsByType.get('Phasor', {}).values():
+        phasor_instance      = params['eid']
+        transporter_instance = params['transporter_eid']
+        #--- Does not make sense to transfer data through ns-3
+        #--- to construct self-loops (source = destination)
+        #--- Connect phasor directly to dsesim
+        if params['self_loop']:
+            if phasor_instance in phasors:
+                world.connect(phasors[phasor_instance], dsesim, 'v', 't')
+            continue
+
+        if phasor_instance in phasors and transporter_instance in transporters:
+            device_transporter_pairs.append((phasors[phasor_instance], transporters[transporter_instance]))
+        if transporter_instance not in created_estimator_conn and transporter_instance in transporters:
+            created_estimator_conn.add(transporter_instance)
+            estimator_transporters.append(transporters[transporter_instance])
+
+    #--- Smartmeter to PktNet(Transporter) to DSE(Estimator)
+    for params in devsByType.get('SmartMeter', {}).values():
+        smartmeter_instance  = params['eid']
+        transporter_instance = params['transporter_eid']
+        if smartmeter_instance in smartmeters and transporter_instance in transporters:
+            device_transporter_pairs.append((smartmeters[smartmeter_instance], transporters[transporter_instance]))
+        if transporter_instance not in created_estimator_conn and transporter_instance in transporters:
+            created_estimator_conn.add(transporter_instance)
+            estimator_transporters.append(transporters[transporter_instance])
+
+    batch_connect(device_transporter_pairs, 'v', 't')
+    mosaik.util.connect_many_to_one(world, estimator_transporters, dsesim, 'v', 't')
+    if args.verbose:
+        for transporter in estimator_transporters:
+            print('Connect', transporter.eid, 'to', dsesim.eid)
+
+    #--- PktNet(Transporter) to Controller to PktNet(Transporter) to Actuator
+    for params in devsByType.get('Actuator', {}).values():
+        client               = params['src']
+        control_loop         = params['cidx']
+        controller_instance  = params['controller_eid']
+        actuator_instance    = params['eid']
+        transporter_instance = params['transporter_eid']
+
+        #--- Controller to PktNet
+        if controller_instance in controllers and transporter_instance in transporters:
+            controller = controllers[controller_instance]
+            transporter = transporters[transporter_instance]
+            world.connect(controller, transporter, 'v', 't')
+            if args.verbose:
+                print('Connect', controller.eid, 'to', transporter.eid)
+    
+        #--- PktNet(Transporter) to Actuator           
+        if actuator_instance in actuators and transporter_instance in transporters:
+            actuator = actuators[actuator_instance]
+            transporter = transporters[transporter_instance]
+            world.connect(transporter, actuator, 'v', 't',
+                time_shifted=True, initial_data=INITIAL_DATA_NONE)
+            if args.verbose:
+                print('Connect', transporter.eid, 'to', actuator.eid)
+
+        #--- PktNet(Transporter) to Controller
+        #--- Find the transporters that need to connect to this controller
+        if controller_instance in controllers:
+            controller = controllers[controller_instance]
+            for transporter in transporter_by_server_cloop.get((client, control_loop), []):
+                world.connect(transporter, controller, 'v', 't',
+                    time_shifted=True, initial_data=INITIAL_DATA_NONE)
+                if args.verbose:
+                    print('Connect', transporter.eid, 'to', controller.eid)
 
     #---
     #--- Simulators to Monitor
     #---
 
     #--- Sensor to Monitor
-    mosaik.util.connect_many_to_one(world, sensors, monitor, 'v', 't')
-    for sensor in sensors:
-        print('Connect', sensor.eid, 'to', monitor.sid)
+    mosaik.util.connect_many_to_one(world, sensors.values(), monitor, 'v', 't')
+    if args.verbose:
+        for sensor in sensors.values():
+            print('Connect', sensor.eid, 'to', monitor.sid)
 
     #--- Controller to Monitor
-    mosaik.util.connect_many_to_one(world, controllers, monitor, 'v', 't')
-    for controller in controllers:
-        print('Connect', controller.eid, 'to', monitor.sid)
+    mosaik.util.connect_many_to_one(world, controllers.values(), monitor, 'v', 't')
+    if args.verbose:
+        for controller in controllers.values():
+            print('Connect', controller.eid, 'to', monitor.sid)
 
     #--- Actuator to Monitor
-    mosaik.util.connect_many_to_one(world, actuators, monitor, 'v', 't')
-    for actuator in actuators:
-        print('Connect', actuator.eid, 'to', monitor.sid)
+    mosaik.util.connect_many_to_one(world, actuators.values(), monitor, 'v', 't')
+    if args.verbose:
+        for actuator in actuators.values():
+            print('Connect', actuator.eid, 'to', monitor.sid)
     
     #--- Prober to Monitor
     mosaik.util.connect_many_to_one(world, probers, monitor, 'v', 't')
-    for prober in probers:
-        print('Connect', prober.eid, 'to', monitor.sid)
+    if args.verbose:
+        for prober in probers:
+            print('Connect', prober.eid, 'to', monitor.sid)
 
     #--- Phasor to Monitor
     # mosaik.util.connect_many_to_one(world, phasors, monitor, 'v', 't')
-    mosaik.util.connect_many_to_one(world, phasors, monitor, 'v', 't', 'event_state')
-    for phasor in phasors:
-        print('Connect', phasor.eid, 'to', monitor.sid)
+    mosaik.util.connect_many_to_one(world, phasors.values(), monitor, 'v', 't', 'event_state')
+    if args.verbose:
+        for phasor in phasors.values():
+            print('Connect', phasor.eid, 'to', monitor.sid)
 
     #--- Smartmeter to Monitor
     # mosaik.util.connect_many_to_one(world, smartmeters, monitor, 'v', 't')
     # meg
-    mosaik.util.connect_many_to_one(world, smartmeters, monitor, 'v', 't', 'event_state')
-    for smartmeter in smartmeters:
-        print('Connect', smartmeter.eid, 'to', monitor.sid)
+    mosaik.util.connect_many_to_one(world, smartmeters.values(), monitor, 'v', 't', 'event_state')
+    if args.verbose:
+        for smartmeter in smartmeters.values():
+            print('Connect', smartmeter.eid, 'to', monitor.sid)
 
-    world.connect(dsesim, monitor, 'v', 't', time_shifted=True, initial_data={'v': [None], 't': [None]})
+    world.connect(dsesim, monitor, 'v', 't', time_shifted=True, initial_data=INITIAL_DATA_NONE)
         
 
 if __name__ == '__main__':
@@ -12,11 +12,13 @@ Works only with MOSAIK 3 and later versions
 Adapted and updated by Meaghan White to include event scheduling/management in 2024.
 '''
 
-import queue
+import heapq
+import itertools
 import random
 import mosaik_api_v3 as mosaik_api
 import os
 import sys
+import io
 import csv
 from SimDSS import SimDSS
 from LoadGenerator import LoadGenerator
@@ -24,7 +26,40 @@ from CktDef import CKTTerm, CKTPhase
 import numpy as np
 import opendssdirect as dss
 import math
-import datetime
+import cmath
+from time import perf_counter_ns
+
+#--- phases measured for each cktPhase of a Phasor/Smartmeter
+PHASE_MAP = {
+    'PHASE_1':   ('PHASE_1',),
+    'PHASE_2':   ('PHASE_2',),
+    'PHASE_3':   ('PHASE_3',),
+    'PHASE_12':  ('PHASE_1', 'PHASE_2'),
+    'PHASE_13':  ('PHASE_1', 'PHASE_3'),
+    'PHASE_23':  ('PHASE_2', 'PHASE_3'),
+    'PHASE_123': ('PHASE_1', 'PHASE_2', 'PHASE_3'),
+}
+
+#--- suffix of the value keys (VA, IA, SPA, ...) of each phase
+PHASE_LETTER = {'PHASE_1': 'A', 'PHASE_2': 'B', 'PHASE_3': 'C'}
+
+
+def meterKernel(V, I, noise):
+    """
+    Add noise to the complex V/I rows in place and return one (5, n) array
+    with the rows VMag, VAng, IMag, IAng and SP = (V*conj(-I)).real.
+    """
+    V += noise[0]
+    I += noise[1]
+    out = np.empty((5, len(V)))
+    np.abs(V, out=out[0])
+    np.arctan2(V.imag, V.real, out=out[1])
+    np.abs(I, out=out[2])
+    np.arctan2(I.imag, I.real, out=out[3])
+    np.multiply(V.real, I.real, out=out[4])
+    out[4] += V.imag * I.imag
+    np.negative(out[4], out=out[4])
+    return out
 
 META = {
     'api-version': '3.0',
@@ -73,6 +108,11 @@ META = {
 
 
 class PhasorSim:
+    __slots__ = ('idt', 'objDSS', 'cktElement', 'cktTerminal', 'cktPhase', 'error',
+                 'verbose', 'priorValue', 'priorTime', 'time_diff_resolution',
+                 'randomTime', 'step_size', 'phases', 'phaseVals', 'vKeys', 'iKeys',
+                 'record')
+
     def __init__(self,
              sid,
              cktTerminal,
@@ -94,80 +134,49 @@ class PhasorSim:
         self.time_diff_resolution = 1e-9
         self.randomTime = random.randint(0, 1)
         self.step_size = int(step_size)
+        #--- Phases measured, in the order of the batched values
+        self.phases    = PHASE_MAP[self.cktPhase]
+        self.phaseVals = tuple(CKTPhase[ph].value for ph in self.phases)
+
+        #--- value keys of the measured phases, fixed by cktPhase
+        self.vKeys = tuple('V' + PHASE_LETTER[ph] for ph in self.phases)
+        self.iKeys = tuple('I' + PHASE_LETTER[ph] for ph in self.phases)
+
+        #--- value template holding every key of this phasor, copied per sample
+        self.record = {'IDT': self.idt, 'TYPE': 'Phasor'}
+        for vKey, iKey in zip(self.vKeys, self.iKeys):
+            self.record[vKey] = None
+            self.record[iKey] = None
+        self.record['TS'] = None
     
-    def updateValues(self, time):
-        if (self.verbose > 2): print(self.idt,'::updateValues', 
-                                     self.cktElement, self.cktTerminal, self.cktPhase)
-
-        if(0 == (time % self.step_size)):
-            val = {}
-            val['IDT'] = self.idt  
-            val['TYPE'] = 'Phasor'
-            
-            if (self.cktPhase == 'PHASE_1'):
-                phases = ['PHASE_1']
-            elif (self.cktPhase == 'PHASE_2'):
-                phases = ['PHASE_2']
-            elif (self.cktPhase == 'PHASE_3'):
-                phases = ['PHASE_3']
-            elif (self.cktPhase == 'PHASE_12'):
-                phases = ['PHASE_1', 'PHASE_2']            
-            elif (self.cktPhase == 'PHASE_13'):
-                phases = ['PHASE_1', 'PHASE_3']
-            elif (self.cktPhase == 'PHASE_23'):
-                phases = ['PHASE_2', 'PHASE_3']              
-            elif (self.cktPhase == 'PHASE_123'):
-                phases = ['PHASE_1', 'PHASE_2', 'PHASE_3']
-
-            for ph in phases:
-                (VComp, IComp, _) = self.objDSS.getCktElementState(self.cktElement, 
-                                                     CKTTerm[self.cktTerminal].value, 
-                                                     CKTPhase[ph].value)
-
-                VComp = self.addNoise(VComp)
-                IComp = self.addNoise(IComp)
-                (VMag, VAng) = self.R2P(VComp)
-                (IMag, IAng) = self.R2P(IComp)
-                
-                if (ph == 'PHASE_1'):
-                    val['VA'] = (VMag, VAng)
-                    val['IA'] = (IMag, IAng)
-                elif (ph == 'PHASE_2'):
-                    val['VB'] = (VMag, VAng)
-                    val['IB'] = (IMag, IAng)
-                elif (ph == 'PHASE_3'):
-                    val['VC'] = (VMag, VAng)
-                    val['IC'] = (IMag, IAng)
-
-            self.priorTime  = time + self.time_diff_resolution
-            self.priorValue = val
-            if (self.verbose > 0): print('Phasor::updateValues Time = ', self.priorTime, 'Value = ', self.priorValue)
-            if (self.verbose > 2): print('Phasor[', self.idt, ']::updateValues v =', val) 
-
-            return (time + self.step_size)
-        else:
-            self.priorTime  = None
-            self.priorValue = None
-            if (self.verbose > 2): print('Phasor[', self.idt, ']::updateValues v =', val) 
-
-            return -1
+    #--- Magnitudes and angles are computed for all due meters at once by
+    #--- PFlowSim.updateMeters; one entry per phase in self.phases
+    def setValues(self, time, VMag, VAng, IMag, IAng):
+        val = self.record.copy()
+        val.update(zip(self.vKeys, zip(VMag, VAng)))
+        val.update(zip(self.iKeys, zip(IMag, IAng)))
+
+        self.priorTime  = time + self.time_diff_resolution
+        self.priorValue = val
+        #--- one test per sample when not verbose
+        if self.verbose:
+            if (self.verbose > 2): print(self.idt,'::setValues', 
+                                         self.cktElement, self.cktTerminal, self.cktPhase)
+            if (self.verbose > 0): print('Phasor::setValues Time = ', self.priorTime, 'Value = ', self.priorValue)
+            if (self.verbose > 2): print('Phasor[', self.idt, ']::setValues v =', val) 
 
     def getLastValue(self):
-        if(self.priorValue != None):
+        if(self.priorValue is not None):
             self.priorValue['TS'] = self.priorTime
         return self.priorValue, self.priorTime
 
-    def R2P(self, x):
-        return np.abs(x), np.angle(x)
-    
-    def addNoise(self, x):
-        noiseReal = np.random.normal(0, self.error, 1)
-        noiseImag = np.random.normal(0, self.error, 1)
-        noise = complex(noiseReal, noiseImag)
-        return x + noise
-
 
 class SmartmeterSim:
+    __slots__ = ('idt', 'objDSS', 'cktElement', 'cktTerminal', 'cktPhase', 'error',
+                 'verbose', 'priorValue', 'priorTime', 'time_diff_resolution',
+                 'randomTime', 'step_size', 'phases', 'phaseVals', 'vKeys', 'spKeys',
+                 'record')
+
     def __init__(self,
              sid,
              cktTerminal,
@@ -189,84 +198,49 @@ class SmartmeterSim:
         self.time_diff_resolution = 1e-9
         self.randomTime = random.randint(0, 1)
         self.step_size = int(step_size)
+        #--- Phases measured, in the order of the batched values
+        self.phases    = PHASE_MAP[self.cktPhase]
+        self.phaseVals = tuple(CKTPhase[ph].value for ph in self.phases)
+
+        #--- value keys of the measured phases, fixed by cktPhase
+        self.vKeys  = tuple('V' + PHASE_LETTER[ph] for ph in self.phases)
+        self.spKeys = tuple('SP' + PHASE_LETTER[ph] for ph in self.phases)
+
+        #--- value template holding every key of this smartmeter, copied per sample
+        self.record = {'IDT': self.idt, 'TYPE': 'Smartmeter'}
+        for vKey, spKey in zip(self.vKeys, self.spKeys):
+            self.record[vKey] = None
+            self.record[spKey] = None
+        self.record['TS'] = None
     
-    def updateValues(self, time):
-        if(0 == (time % self.step_size)):
-            if (self.verbose > 2): print('Smartmeter::updateValues', 
-                                    self.cktElement, self.cktTerminal, self.cktPhase)
-        
+    #--- Voltage magnitudes and real powers are computed for all due meters
+    #--- at once by PFlowSim.updateMeters; one entry per phase in self.phases
+    def setValues(self, time, VMag, SP):
         # if (0 == time % (self.step_size + self.randomTime)):
         # for now assume that there is no randomTime
-        if (0 == time % (self.step_size)):
-            val = {}
-            val['IDT'] = self.idt
-            val['TYPE'] = 'Smartmeter'
-            
-            if (self.cktPhase == 'PHASE_1'):
-                phases = ['PHASE_1']
-            elif (self.cktPhase == 'PHASE_2'):
-                phases = ['PHASE_2']
-            elif (self.cktPhase == 'PHASE_3'):
-                phases = ['PHASE_3']
-            elif (self.cktPhase == 'PHASE_12'):
-                phases = ['PHASE_1', 'PHASE_2']            
-            elif (self.cktPhase == 'PHASE_13'):
-                phases = ['PHASE_1', 'PHASE_3']
-            elif (self.cktPhase == 'PHASE_23'):
-                phases = ['PHASE_2', 'PHASE_3']              
-            elif (self.cktPhase == 'PHASE_123'):
-                phases = ['PHASE_1', 'PHASE_2', 'PHASE_3']
-
-            for ph in phases:
-                (VComp, IComp, _) = self.objDSS.getCktElementState(self.cktElement,                               
-                                                     CKTTerm[self.cktTerminal].value, 
-                                                     CKTPhase[ph].value)
-                
-                VComp = self.addNoise(VComp)
-                IComp = self.addNoise(IComp)                
-                (VMag, _) = self.R2P(VComp)
-                SP = (VComp * np.conj(-IComp)).real
-                
-                #--- for voltage
-                if (ph == 'PHASE_1'):
-                    val['VA'] = VMag
-                    val['SPA'] = SP
-                elif (ph == 'PHASE_2'):
-                    val['VB'] = VMag
-                    val['SPB'] = SP
-                elif (ph == 'PHASE_3'):
-                    val['VC'] = VMag
-                    val['SPC'] = SP
-
-            self.priorTime  = time + self.time_diff_resolution
-            self.priorValue = val
-            if (self.verbose > 0): print('Smartmeter::updateValues Time = ', self.priorTime, 'Value = ', self.priorValue)
-            if (self.verbose > 2): print('Smartmeter[', self.idt, ']::updateValues v =', val)
-        
-            return (time + self.step_size)
-        else:
-            self.priorTime  = None
-            self.priorValue = None 
-            if (self.verbose > 2): print('Smartmeter[', self.idt, ']::updateValues v =', val)
-        
-            return -1 
+        val = self.record.copy()
+        val.update(zip(self.vKeys, VMag))
+        val.update(zip(self.spKeys, SP))
+
+        self.priorTime  = time + self.time_diff_resolution
+        self.priorValue = val
+        #--- one test per sample when not verbose
+        if self.verbose:
+            if (self.verbose > 2): print('Smartmeter::setValues', 
+                                    self.cktElement, self.cktTerminal, self.cktPhase)
+            if (self.verbose > 0): print('Smartmeter::setValues Time = ', self.priorTime, 'Value = ', self.priorValue)
+            if (self.verbose > 2): print('Smartmeter[', self.idt, ']::setValues v =', val)
 
     def getLastValue(self):
-        if(self.priorValue != None):
+        if(self.priorValue is not None):
             self.priorValue['TS'] = self.priorTime
         return self.priorValue, self.priorTime
 
-    def R2P(self, x):
-        return np.abs(x), np.angle(x)
-    
-    def addNoise(self, x):
-        noiseReal = np.random.normal(0, self.error, 1)
-        noiseImag = np.random.normal(0, self.error, 1)
-        noise = complex(noiseReal, noiseImag)
-        return x + noise
-
 
 class ProberSim:
+    __slots__ = ('idt', 'step_size', 'objDSS', 'elem', 'term', 'ph', 'verbose',
+                 'priorValue', 'priorTime', 'cidx', 'dssArgs')
+
     def __init__(self, eid, step_size, objDSS, element, terminal, phase, verbose):
         self.idt        = eid
         self.step_size  = int(step_size)
@@ -278,26 +252,32 @@ class ProberSim:
         self.verbose    = verbose
         self.priorValue = None
         self.priorTime  = None
+
+        # No more action variable, use cidx and didx to determine
+        # 0 = voltage, 1 = tap, 2 = load, 3 = voltage phase angle
+        self.cidx = eid.split('.')[1]
+        #--- OpenDSS arguments resolved once for the probed quantity
+        if (self.cidx == '0'):
+            self.dssArgs = (self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)
+        elif (self.cidx == '3'):
+            self.dssArgs = (self.elem, CKTPhase[self.ph].value)
+        else:
+            self.dssArgs = (self.elem,)
         
     def updateValues(self, time):
         if (self.verbose > 0): print('ProberSim::updateValues', self.idt, self.elem, self.term, self.ph)
         
         if (0 == time % self.step_size):
-            # No more action variable, use cidx and didx to determine
-            eid = self.idt
-            eid = eid.split('.')
-            cidx = eid[1]
-            didx = eid[2]
-            # 0 = voltage, 1 = tap, 2 = load, 3 = voltage phase angle
+            cidx = self.cidx
             if (cidx == '0'):
-                (VComp, _, _) =  self.objDSS.getCktElementState(self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)
+                (VComp, _, _) =  self.objDSS.getCktElementState(*self.dssArgs)
                 val = self.R2P(VComp)[0] #-- only got the real part    
             if (cidx == '1'):
-                val = self.objDSS.getTrafoTap(self.elem)
+                val = self.objDSS.getTrafoTap(*self.dssArgs)
             if (cidx == '3'):
-                (val, _) =  self.objDSS.getVMagAnglePu(self.elem, CKTPhase[self.ph].value)
+                (val, _) =  self.objDSS.getVMagAnglePu(*self.dssArgs)
             if (cidx == '2'):
-                (val, _) = self.objDSS.getPQ(self.elem)       
+                (val, _) = self.objDSS.getPQ(*self.dssArgs)       
             # if (self.action == "getS"):
             #     val = self.objDSS.getS(self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)          
             
@@ -307,18 +287,22 @@ class ProberSim:
             self.priorTime  = None
             self.priorValue = None          
             
-        if (self.verbose > 0): print('ProberSim::updateValues Time = ', self.priorTime, 'Value = ', self.priorValue)
-        if (self.verbose > 2): print('ProberSim[', self.idt, ']::updateValues v =', val)   
+        if self.verbose:
+            if (self.verbose > 0): print('ProberSim::updateValues Time = ', self.priorTime, 'Value = ', self.priorValue)
+            if (self.verbose > 2): print('ProberSim[', self.idt, ']::updateValues v =', self.priorValue)   
     
     def getLastValue(self):
         return self.priorValue, self.priorTime
      
     def R2P(self, x):
-        return np.abs(x), np.angle(x)
+        return cmath.polar(complex(x))
 
 
 
 class SensorSim:
+    __slots__ = ('idt', 'step_size', 'objDSS', 'elem', 'term', 'ph', 'verbose',
+                 'priorValue', 'priorTime', 'time_diff_resolution', 'dssArgs')
+
     def __init__(self, eid, step_size, objDSS, element, terminal, phase, verbose):
         self.idt        = eid
         self.step_size  = int(step_size)
@@ -331,6 +315,8 @@ class SensorSim:
         self.priorValue = None
         self.priorTime  = None
         self.time_diff_resolution = 1e-9
+        #--- OpenDSS arguments resolved once for the voltage reading
+        self.dssArgs    = (self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)
         
         
     def updateValues(self, time):
@@ -339,22 +325,22 @@ class SensorSim:
         if (0 == time % self.step_size):
             # no action choice - default action is get voltage value
             # if (self.action == "getV"):
-            (VComp, _, _) =  self.objDSS.getCktElementState(self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)
+            (VComp, _, _) =  self.objDSS.getCktElementState(*self.dssArgs)
             val = self.R2P(VComp)[0] #-- only got the real part
             # if (self.action == "getTap"):
             #     val = self.objDSS.getTrafoTap(self.elem)
             self.priorTime  = time + self.time_diff_resolution
             self.priorValue = val
-            if (self.verbose > 0): print('SensorSim::getValue Time = ', self.priorTime, 'Value = ', self.priorValue)
-            if (self.verbose > 1): print('SensorSim::getValue Next step = ', time + self.step_size)
-            if (self.verbose > 2): print('SensorSim[', self.idt, ']::getValue v =', val)        
+            if self.verbose:
+                if (self.verbose > 0): print('SensorSim::getValue Time = ', self.priorTime, 'Value = ', self.priorValue)
+                if (self.verbose > 1): print('SensorSim::getValue Next step = ', time + self.step_size)
+                if (self.verbose > 2): print('SensorSim[', self.idt, ']::getValue v =', val)        
 
             return (time + self.step_size)
         else:
             self.priorTime  = None
             self.priorValue = None
             if (self.verbose > 0): print('SensorSim::getValue Time = ', self.priorTime, 'Value = ', self.priorValue)
-            if (self.verbose > 2): print('SensorSim[', self.idt, ']::getValue v =', val)        
 
             return -1
             
@@ -365,11 +351,14 @@ class SensorSim:
 
     
     def R2P(self, x):
-        return np.abs(x), np.angle(x)
+        return cmath.polar(complex(x))
 
 
 
 class ActuatorSim:
+    __slots__ = ('eid', 'step_size', 'objDSS', 'elem', 'term', 'ph', 'verbose',
+                 'priorValue', 'priorTime')
+
     def __init__(self, eid, step_size, objDSS, element, terminal, phase, verbose):
         self.eid        = eid
         self.step_size  = int(step_size)
@@ -383,20 +372,23 @@ class ActuatorSim:
         self.priorTime  = None
 
         
+    #--- Records the control; returns True if it has to be applied to OpenDSS,
+    #--- which PFlowSim does with applyControl once all inputs of the step are read
     def setControl(self, value, time):
-        if (self.verbose > 0): print('ActuatorSim::setControl', self.action, self.elem, self.term, self.ph, value)
-        
-        if (value != 0 and value != None):
-            # No more action choices - default action is set tap
-            # if (self.action == "ctlS"):
-            #     self.objDSS.operateSwitch(int(value), self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)
-            # if (self.action == "setTap"):
-            self.objDSS.setTrafoTap(self.elem, tapOrientation=value, tapUnits=1)                
+        if (self.verbose > 0): print('ActuatorSim::setControl', self.eid, self.elem, self.term, self.ph, value)
              
         self.priorTime  = time
         self.priorValue = value
 
-        if (self.verbose > 2): print('ActuatorSim[', self.idt, ']::setControl c =', value, 'time = ', time)        
+        if (self.verbose > 2): print('ActuatorSim[', self.eid, ']::setControl c =', value, 'time = ', time)        
+        return (value is not None and value != 0)
+
+    def applyControl(self, value):
+        # No more action choices - default action is set tap
+        # if (self.action == "ctlS"):
+        #     self.objDSS.operateSwitch(int(value), self.elem, CKTTerm[self.term].value, CKTPhase[self.ph].value)
+        # if (self.action == "setTap"):
+        self.objDSS.setTrafoTap(self.elem, tapOrientation=value, tapUnits=1)                
 
 
     def getLastValue(self):
@@ -410,24 +402,75 @@ class ActuatorSim:
         
         return value, time
 
+    @staticmethod
+    def getLastValues(actuators):
+        """
+        Reads and resets the last values of several actuators in one call,
+        returning the lists of values and times.
+        """
+        values = [actuator.priorValue for actuator in actuators]
+        times  = [actuator.priorTime for actuator in actuators]
+        for actuator in actuators:
+            if (actuator.verbose > 0): print('ActuatorSim::getLastValue', actuator.priorValue, actuator.priorTime)
+            actuator.priorValue = None
+            actuator.priorTime  = None
+        return values, times
+
 
 
 class PFlowSim(mosaik_api.Simulator):
     def __init__(self):
         super().__init__(META)
-        self.data = {}
+        #--- last value and time sent by get_data, one slot per actuator
+        self.last_v = []
+        self.last_t = []
         self.next_step = 0
         self.instances = {}
         self.loadgen_interval = 1
         self.event_interval = 10000
         self.time = -1
-        self.next_steps = queue.PriorityQueue()
+        #--- distinct step sizes of the periodic sensors, the next step is the
+        #--- earliest upcoming multiple of any of them
+        self.step_sizes = set()
+        #--- heap of (evt_time, seq, evt_func, evt_args, evt_type), seq keeps
+        #--- events at the same time in scheduling order; evt_func is a
+        #--- PFlowSim function called with the simulator as first argument
         self.scheduled_events = []
+        self.event_seq = itertools.count()
         self.active_events = set()
-
-    def init(self, sid, time_resolution, topofile, nwlfile, loadgen_interval, enable_events=0, event_interval=10000, ilpqfile="", verbose=0):	
+        #--- cached get_event_state result, reset whenever active_events changes
+        self.event_state = None
+        #--- instances updated by step, partitioned by model in create
+        self.sensors = []
+        self.probers = []
+        #--- outputs read by get_data: the output slot of each actuator, and
+        #--- (eid, getLastValue) bucketed by step size for the periodic instances
+        self.actuator_slots = {}
+        self.periodic_outputs = {}
+        #--- actuators given a control since the last get_data, in order;
+        #--- only these can hold a value to send
+        self.controlled_actuators = {}
+        #--- heap of (next_fire, step_size) per bucket and the buckets due at
+        #--- due_time, so repeated get_data calls at one time reuse them
+        self.output_heap = []
+        self.due_time    = None
+        self.due_outputs = []
+        #--- periodic part of get_data, reused until the next step
+        self.periodic_data      = {}
+        self.periodic_data_step = None
+        #--- Phasors and Smartmeters, sampled together in updateMeters
+        self.meters = []
+        self.meterSteps = None
+        #--- measurement noise generator, reseeded in init
+        self.rng = np.random.default_rng()
+
+    def init(self, sid, time_resolution, topofile, nwlfile, loadgen_interval, enable_events=0, event_interval=10000, ilpqfile="", verbose=0, seed=None, apply_missed_loads=0, flush_stdout=0, force_actuator_outputs=0):	
         self.sid = sid       
         self.verbose = verbose
+        self.apply_missed_loads = apply_missed_loads
+        self.flush_stdout = flush_stdout
+        self.force_actuator_outputs = force_actuator_outputs
+        self.rng = np.random.default_rng(seed)
         self.loadgen_interval = loadgen_interval
         self.event_interval = event_interval
         self.enable_events = enable_events
@@ -436,7 +479,7 @@ class PFlowSim(mosaik_api.Simulator):
         if enable_events:
             print("Running failure events!")
             # Ensure the test event includes all four fields
-            self.scheduled_events = [(0, self.apply_fault, ("Line.611",), "start")]
+            self.schedule_event(0, PFlowSim.apply_fault, ("Line.611",), "start")
 
             print("Test event scheduled for time 0")
             sim_duration = 604800  # One week in seconds (can be parameterized)
@@ -447,7 +490,8 @@ class PFlowSim(mosaik_api.Simulator):
 
         self.swpos = 0
         self.swcycle = 35
-        self.total_exec_time = 0.0
+        #--- step wall time in ns, only measured when verbose
+        self.total_exec_ns = 0
         self.step_count = 0
         
         if (self.verbose > 0): print('simulator_pflow::init', self.sid)
@@ -474,13 +518,12 @@ class PFlowSim(mosaik_api.Simulator):
                                         Freq       =  1./1250,
                                         PhaseShift = math.pi)
     
-        sys.stdout.flush()
+        if self.flush_stdout: sys.stdout.flush()
         return self.meta
 
     def create(self, num, model, cktTerminal, cktPhase, eid, step_size, cktElement, error, verbose):
         if (self.verbose > 0): print('simulator_pflow::create ', model, ": ", eid)
 
-        self.data[eid] = {}     
         self.instances[eid] = {}
 
         if (model == 'Phasor'): 
@@ -505,6 +548,14 @@ class PFlowSim(mosaik_api.Simulator):
                                             verbose      = verbose
                                            )
 
+        if (model == 'Phasor') or (model == 'Smartmeter'):
+            self.meters.append(self.instances[eid])
+            #--- meter arrays are rebuilt on the next step
+            self.meterSteps = None
+
+        if (model == 'Phasor') or (model == 'Smartmeter') or (model == 'Sensor'):
+            self.step_sizes.add(int(step_size))
+
         if (model == 'Prober'):
             self.instances[eid] = ProberSim(eid,
                                         step_size = step_size, 
@@ -513,6 +564,7 @@ class PFlowSim(mosaik_api.Simulator):
                                         terminal  = cktTerminal, 
                                         phase     = cktPhase,
                                         verbose   = verbose)
+            self.probers.append(self.instances[eid])
 
         if (model == 'Sensor'):
             self.instances[eid] = SensorSim(eid,
@@ -522,6 +574,7 @@ class PFlowSim(mosaik_api.Simulator):
                                         terminal  = cktTerminal, 
                                         phase     = cktPhase,
                                         verbose   = verbose)
+            self.sensors.append(self.instances[eid])
             
         if (model == 'Actuator'):
             self.instances[eid] = ActuatorSim(eid, 
@@ -531,44 +584,122 @@ class PFlowSim(mosaik_api.Simulator):
                                         terminal  = cktTerminal, 
                                         phase     = cktPhase,
                                         verbose   = verbose)            
+
+        if (model == 'Actuator'):
+            self.actuator_slots[eid] = len(self.last_v)
+            self.last_v.append(None)
+            self.last_t.append(None)
+        else:
+            step_size = self.instances[eid].step_size
+            if step_size not in self.periodic_outputs:
+                self.periodic_outputs[step_size] = []
+                heapq.heappush(self.output_heap, (0, step_size))
+                self.due_time = None
+            self.periodic_data_step = None
+            self.periodic_outputs[step_size].append((eid, self.instances[eid].getLastValue))
         
-        sys.stdout.flush()
+        if self.flush_stdout: sys.stdout.flush()
         return [{'eid': eid, 'type': model}]
 
     
+    def buildMeterArrays(self):
+        """
+        Lay the meters out as parallel arrays with one row per measured phase.
+        """
+        self.meterSteps   = np.array([meter.step_size for meter in self.meters], dtype=np.int64)
+        #--- next sample time of each meter, advanced when the time moves on
+        self.meterNextFire = np.zeros(len(self.meters), dtype=np.int64)
+        self.meterTime    = None
+        self.meterIsPhasor = np.array([isinstance(meter, PhasorSim) for meter in self.meters], dtype=bool)
+        self.meterRows    = np.array([len(meter.phases) for meter in self.meters], dtype=np.int64)
+        self.rowMeter     = np.repeat(np.arange(len(self.meters)), self.meterRows)
+        self.rowError     = np.array([meter.error for meter in self.meters for ph in meter.phases])
+        self.rowArgs      = [(meter.cktElement, CKTTerm[meter.cktTerminal].value, phaseVal)
+                             for meter in self.meters for phaseVal in meter.phaseVals]
+
+    def updateMeters(self, time):
+        """
+        Sample every due Phasor and Smartmeter in one pass: the OpenDSS states
+        are gathered per row, then noise, magnitudes, angles and powers are
+        computed for all rows at once and handed back to the meters.
+        """
+        if self.meterSteps is None:
+            self.buildMeterArrays()
+
+        #--- on a new time, move the meters sampled before it to their next
+        #--- multiple; a re-step at the same time samples the same meters again
+        if time != self.meterTime:
+            stale = self.meterNextFire < time
+            self.meterNextFire[stale] += self.meterSteps[stale]
+            #--- times skipped by the scheduler, realign on the step grid
+            stale = self.meterNextFire < time
+            if stale.any():
+                self.meterNextFire[stale] = -(-time // self.meterSteps[stale]) * self.meterSteps[stale]
+            self.meterTime = time
+
+        due = np.flatnonzero(self.meterNextFire == time)
+        if len(due) == 0:
+            return
+        rows = np.flatnonzero(np.isin(self.rowMeter, due))
+
+        getState = self.dssObj.getCktElementState
+        rowArgs  = self.rowArgs
+        states = [getState(*rowArgs[r]) for r in rows.tolist()]
+        V = np.fromiter((state[0] for state in states), dtype=np.complex128, count=len(rows))
+        I = np.fromiter((state[1] for state in states), dtype=np.complex128, count=len(rows))
+
+        #--- complex gaussian noise with the error of each row's meter,
+        #--- drawn for V and I of all rows at once
+        noise = self.rng.standard_normal((2, len(rows), 2)).view(np.complex128)[..., 0]
+        noise *= self.rowError[rows]
+        VMag, VAng, IMag, IAng, SP = meterKernel(V, I, noise).tolist()
+
+        meters    = self.meters
+        meterRows = self.meterRows[due].tolist()
+        isPhasor  = self.meterIsPhasor[due].tolist()
+        start = 0
+        for i, nrows, phasor in zip(due.tolist(), meterRows, isPhasor):
+            end = start + nrows
+            if phasor:
+                meters[i].setValues(time, VMag[start:end], VAng[start:end], IMag[start:end], IAng[start:end])
+            else:
+                meters[i].setValues(time, VMag[start:end], SP[start:end])
+            start = end
+
+    def schedule_event(self, evt_time, evt_func, evt_args, evt_type):
+        heapq.heappush(self.scheduled_events, (evt_time, next(self.event_seq), evt_func, evt_args, evt_type))
+
     def schedule_events(self, sim_duration, event_interval):
-        possible_events = [
-            (self.apply_fault, ("6054-6110",), 100, (self.remove_fault, ("6054-6110",))),
-            (self.change_load, ("6110.1",), 500, (self.restore_load, ("6110.1",)))
-            # no generators in this scenario
-        ]
+        # Sample the event of every interval at once
+        event_times = np.arange(0, sim_duration + 1, event_interval)
+        event_picks = self.rng.integers(0, len(self.EVENT_FUNCS), size=len(event_times))
 
-        current_time = 0
-        while current_time <= sim_duration:
-            evt_func, evt_args, duration, resolution_event = random.choice(possible_events)
+        for current_time, pick in zip(event_times.tolist(), event_picks.tolist()):
+            evt_args = self.EVENT_ARGS[pick]
 
             # Schedule the event start
-            self.scheduled_events.append((current_time, evt_func, evt_args, "start"))
+            self.scheduled_events.append((current_time, next(self.event_seq), self.EVENT_FUNCS[pick], evt_args, "start"))
 
             # Schedule the event resolution
-            if resolution_event:
-                resolution_func, resolution_args = resolution_event
-                resolution_time = current_time + duration
-                self.scheduled_events.append((resolution_time, resolution_func, resolution_args, "end"))
+            resolution_func = self.EVENT_RESOLUTION_FUNCS[pick]
+            if resolution_func is not None:
+                resolution_time = current_time + self.EVENT_DURATIONS[pick]
+                self.scheduled_events.append((resolution_time, next(self.event_seq), resolution_func, evt_args, "end"))
 
-            current_time += event_interval
+        heapq.heapify(self.scheduled_events)
 
     def apply_fault(self, line_id):
         """
         Simulate a fault by modifying line impedance.
         """
-        print(f"Applying fault on line {line_id}")
+        if (self.verbose > 0): print(f"Applying fault on line {line_id}")
         if line_id == "6054-6110":
             dss.Lines.Name(line_id)
             dss.Lines.R1(0.5)  # Increase resistance
             dss.Lines.X1(0.1)  # Increase reactance
             self.active_events.add(f"Fault_6054-6110")
-            print(f"Line {line_id} impedance modified for fault: R1=0.5, X1=0.1")
+            self.event_state = None
+            if (self.verbose > 0): print(f"Line {line_id} impedance modified for fault: R1=0.5, X1=0.1")
         else:
             print("Unexpected targeting of fault!")
 
@@ -577,42 +708,46 @@ class PFlowSim(mosaik_api.Simulator):
         """
         Restore original line impedance values.
         """
-        print(f"Restoring line {line_id} to original state")
+        if (self.verbose > 0): print(f"Restoring line {line_id} to original state")
         if line_id == "6054-6110":
             dss.Lines.Name(line_id)
             dss.Lines.R1(0.00931)  # Restore original resistance
             dss.Lines.X1(0.00071)  # Restore original reactance
             self.active_events.discard(f"Fault_6054-6110")
-            print(f"Line {line_id} restored to original impedance: R1=0.00931, X1=0.00071")
+            self.event_state = None
+            if (self.verbose > 0): print(f"Line {line_id} restored to original impedance: R1=0.00931, X1=0.00071")
         else:
             print("Unexpected targeting of fault!")
 
     # FYI: NO GENERATORS IN BASE CASE
     def trip_generator(self, gen_id):
         """Trips a generator by setting its output to zero."""
-        print(f"Tripping generator {gen_id}")
+        if (self.verbose > 0): print(f"Tripping generator {gen_id}")
         dss.run_command(f"Edit Generator.{gen_id} kW=0 kvar=0")
         self.active_events.add(f"GeneratorTrip_{gen_id}")
+        self.event_state = None
 
     def fix_generator(self, gen_id, kw, kvar):
         """Restores a generator to its specified output."""
-        print(f"Restoring generator {gen_id} to {kw} kW and {kvar} kvar")
+        if (self.verbose > 0): print(f"Restoring generator {gen_id} to {kw} kW and {kvar} kvar")
         dss.run_command(f"Edit Generator.{gen_id} kW={kw} kvar={kvar}")
         self.active_events.discard(f"GeneratorTrip_{gen_id}")
+        self.event_state = None
 
 
     def change_load(self, load_id):
         """
         Hardcoded load modification: Set load at `6110.1` to a disturbance state.
         """
-        print(f"Modifying load at {load_id}")
+        if (self.verbose > 0): print(f"Modifying load at {load_id}")
         if load_id == "6110.1":
             dss.Loads.Name(load_id)
             dss.Loads.kW(100)  # Example: Surge to 100 kW
             dss.Loads.kvar(50)  # Example: Surge to 50 kvar
             dss.Loads.kV(0.240)  # Maintain original voltage level
-            print(f"Load {load_id} set to disturbance state: 100 kW, 50 kvar")
+            if (self.verbose > 0): print(f"Load {load_id} set to disturbance state: 100 kW, 50 kvar")
             self.active_events.add(f"LoadChange_6110.1")
+            self.event_state = None
         else:
             print("Dynamic load change not implemented yet!")
 
@@ -621,7 +756,7 @@ class PFlowSim(mosaik_api.Simulator):
         """
         Hardcoded load restoration: Reset `6110.1` to its original state.
         """
-        print(f"Restoring load at {load_id}")
+        if (self.verbose > 0): print(f"Restoring load at {load_id}")
         if load_id == "6110.1":
             dss.Loads.Name(load_id)
             dss.Loads.kW(0)
@@ -630,13 +765,26 @@ class PFlowSim(mosaik_api.Simulator):
             dss.Loads.VMinPU(0.9)
             dss.Loads.VMaxPU(1.1)
             self.active_events.discard(f"LoadChange_6110.1")
-            print(f"Load {load_id} restored to original state: 0 kW, 0 kvar")
+            self.event_state = None
+            if (self.verbose > 0): print(f"Load {load_id} restored to original state: 0 kW, 0 kvar")
         else:
             print("Unexpected outcome in restore_load().")
 
 
+    #--- Events sampled by schedule_events, as parallel tables indexed by the
+    #--- picked event; the resolution is called with the same arguments
+    #--- no generators in this scenario
+    EVENT_FUNCS            = (apply_fault, change_load)
+    EVENT_ARGS             = (("6054-6110",), ("6110.1",))
+    EVENT_DURATIONS        = (100, 500)
+    EVENT_RESOLUTION_FUNCS = (remove_fault, restore_load)
+
+
     def get_event_state(self):
         """Returns a dictionary indicating which events are active."""
+        if self.event_state is not None:
+            return self.event_state
+
         event_state = {
             "Normal": len(self.active_events) == 0,
             "Fault": any(event.startswith("Fault_") for event in self.active_events),
@@ -645,7 +793,8 @@ class PFlowSim(mosaik_api.Simulator):
         }
 
         # Debug: Show the current event state
-        print("DEBUG: Event State:", event_state)
+        if (self.verbose > 2): print("DEBUG: Event State:", event_state)
+        self.event_state = event_state
         return event_state
 
 
@@ -653,7 +802,7 @@ class PFlowSim(mosaik_api.Simulator):
     ###
 
     def step(self, time, inputs, max_advance):
-        start = datetime.datetime.now()
+        if (self.verbose > 0): start = perf_counter_ns()
         self.step_count = self.step_count + 1
         if (self.verbose > 0): print('simulator_pflow::step time = ', time, ' Max Advance = ', max_advance)
         if (self.verbose > 1): print('simulator_pflow::step inputs = ', inputs)
@@ -693,104 +842,124 @@ class PFlowSim(mosaik_api.Simulator):
                 #-- IEEE33 Get loads for standard TEST dataset
                 # ePQ = self.objLoadGen.readLoads(True)
 
-                #-- execute processing of the the new elastic load
-                self.dssObj.setLoads(ePQ)
+                #-- execute processing of the the new elastic load; when
+                #-- catching up on missed samples only the latest one is
+                #-- applied, the earlier ones are read to advance the loadgen
+                if self.apply_missed_loads or (i == loadGen_cnt - 1):
+                    self.dssObj.setLoads(ePQ)
        
-        # Handle scheduled events
-        events_to_remove = []
-        for (evt_time, evt_func, evt_args, evt_type) in self.scheduled_events:
-            if self.time >= evt_time:
-                print(f"Triggering event {evt_func.__name__} at time {self.time} ({evt_type})")
-                evt_func(*evt_args)
-                events_to_remove.append((evt_time, evt_func, evt_args, evt_type))
-
-        # Remove triggered events from the schedule
-        for e in events_to_remove:
-            self.scheduled_events.remove(e)
+        # Handle scheduled events, popping them off the heap as they trigger
+        while self.scheduled_events and self.scheduled_events[0][0] <= self.time:
+            evt_time, _, evt_func, evt_args, evt_type = heapq.heappop(self.scheduled_events)
+            if (self.verbose > 0): print(f"Triggering event {evt_func.__name__} at time {self.time} ({evt_type})")
+            evt_func(self, *evt_args)
 
         #--- Use actuators to update opendss state with actions received by controllers (Mosaik)
+        #--- the actions are staged and applied together after all inputs are read
+        pending_controls = []
         for eid, attrs in inputs.items():
-            vlist = list(attrs['v'].values())[0]
-            tlist = list(attrs['t'].values())[0]
-            for i in range(0, len(vlist)):
-                value_v = vlist[i]
-                value_t = tlist[i]
-                if (value_v != 'None' and value_v != None):
+            actuator = self.instances[eid]
+            vlist = next(iter(attrs['v'].values()))
+            tlist = next(iter(attrs['t'].values()))
+            for value_v, value_t in zip(vlist, tlist):
+                if (value_v is not None and value_v != 'None'):
                     if (self.verbose > 1): print('simulator_pflow::step Propagation delay =', time - value_t)
-                    self.instances[eid].setControl(value_v, time)
+                    self.controlled_actuators[eid] = actuator
+                    if actuator.setControl(value_v, time):
+                        pending_controls.append((actuator, value_v))
+        for actuator, value_v in pending_controls:
+            actuator.applyControl(value_v)
         
         #--- 
         #--- get new set of sensor data from OpenDSS
         #---   
-        for instance_eid in self.instances:
-            if (instance_eid.find("Sensor") > -1) or \
-                (instance_eid.find("Phasor") > -1) or \
-                (instance_eid.find("SmartMeter") > -1):
-                self.next_step = self.instances[instance_eid].updateValues(time)
-                if self.next_step != -1:
-                    self.next_steps.put(self.next_step)
+        for sensor in self.sensors:
+            sensor.updateValues(time)
+        self.updateMeters(time)
 
         #--- 
         #--- get new set of prober data from OpenDSS
         #---   
-        for instance_eid in self.instances:
-            if instance_eid.find("Prober") > -1:
-                self.instances[instance_eid].updateValues(time)
+        for prober in self.probers:
+            prober.updateValues(time)
                     
 
-        #--- Filter the next time steps and return the earliest next time step
-        self.next_step = self.next_steps.queue[0]
+        #--- Return the earliest next multiple of any sensor step size
         #--- For a time-based simulator, there is always a next step
-        while(self.time >= self.next_steps.queue[0]):
-            self.next_step = self.next_steps.get()
-        self.next_step = self.next_steps.queue[0]
+        self.next_step = time + min(step_size - time % step_size for step_size in self.step_sizes)
 
         if(self.verbose > 1):
             print('simulator_pflow::step next_step = ', self.next_step)
-        sys.stdout.flush()
 	
-        end = datetime.datetime.now()
-        self.total_exec_time = self.total_exec_time + (end - start).total_seconds()
+        if (self.verbose > 0): self.total_exec_ns += perf_counter_ns() - start
         return self.next_step
 
 
     def get_data(self, outputs):
-        start = datetime.datetime.now()
         if (self.verbose > 0): print('simulator_pflow::get_data INPUT', outputs)
         
-        data = {}
         event_state = self.get_event_state()
+
+        #--- the periodic values only change in step, repeated calls in
+        #--- between copy the entries read by the first one
+        if self.step_count != self.periodic_data_step:
+            periodic_data = {}
+            for bucket in self.get_due_outputs():
+                for instance_eid, getLastValue in bucket:
+                    val_v, val_t = getLastValue()
+                    #--- nothing to send without a reading, as for the actuators
+                    if (val_t is not None):
+                        periodic_data[instance_eid] = {'v': [val_v], 't': [val_t], 'event_state': [event_state]}
+            self.periodic_data      = periodic_data
+            self.periodic_data_step = self.step_count
+        data = dict(self.periodic_data)
         
-        for instance_eid in self.instances:
-            if (instance_eid.find("Actuator") > -1):
-                val_v, val_t = self.instances[instance_eid].getLastValue()
-                self.data[instance_eid]['v'] = val_v
-                self.data[instance_eid]['t'] = val_t
-                if (val_t != None):
-                    data[instance_eid] = {}
-                    data[instance_eid]['v'] = []
-                    data[instance_eid]['t'] = []
-                    data[instance_eid]['event_state'] = []
-                    data[instance_eid]['v'].append(self.data[instance_eid]['v'])
-                    data[instance_eid]['t'].append(self.data[instance_eid]['t'])
-                    data[instance_eid]['event_state'].append(event_state)
-                    
-            elif (self.time % self.instances[instance_eid].step_size == 0):
-                val_v, val_t = self.instances[instance_eid].getLastValue()
-                self.data[instance_eid]['v'] = val_v
-                self.data[instance_eid]['t'] = val_t
-                data[instance_eid] = {}
-                data[instance_eid]['v'] = []
-                data[instance_eid]['t'] = []
-                data[instance_eid]['event_state'] = []
-                data[instance_eid]['v'].append(self.data[instance_eid]['v'])
-                data[instance_eid]['t'].append(self.data[instance_eid]['t'])
-                data[instance_eid]['event_state'].append(event_state)
+        if self.controlled_actuators:
+            actuator_slots = self.actuator_slots
+            last_v = self.last_v
+            last_t = self.last_t
+            force = self.force_actuator_outputs
+            values, times = ActuatorSim.getLastValues(list(self.controlled_actuators.values()))
+            for instance_eid, val_v, val_t in zip(self.controlled_actuators, values, times):
+                slot = actuator_slots[instance_eid]
+                #--- a re-step may set the same control at the same time
+                #--- again, it was already sent with the first read
+                if (not force and val_t is not None and
+                        val_t == last_t[slot] and val_v == last_v[slot]):
+                    continue
+                last_v[slot] = val_v
+                last_t[slot] = val_t
+                if (val_t is not None):
+                    data[instance_eid] = {'v': [val_v], 't': [val_t], 'event_state': [event_state]}
+            self.controlled_actuators.clear()
 
         if (self.verbose > 1): print('simulator_pflow::get_data data:', data)
 
         return data
 
+    def get_due_outputs(self):
+        """
+        Returns the periodic output buckets whose step size divides the current
+        time, popping them off the next-fire heap once per time.
+        """
+        if self.time == self.due_time:
+            return self.due_outputs
+
+        due = []
+        while self.output_heap and self.output_heap[0][0] <= self.time:
+            next_fire, step_size = heapq.heappop(self.output_heap)
+            #--- times skipped by the scheduler, realign on the step grid
+            if next_fire < self.time:
+                next_fire = -(-self.time // step_size) * step_size
+            if next_fire == self.time:
+                due.append(self.periodic_outputs[step_size])
+                next_fire += step_size
+            heapq.heappush(self.output_heap, (next_fire, step_size))
+
+        self.due_time    = self.time
+        self.due_outputs = due
+        return due
+
     def set_next(self, pflow, instance, parameters):
         if (self.verbose > 2): print('simulator_pflow::set_next', instance, parameters)
         
@@ -798,7 +967,10 @@ class PFlowSim(mosaik_api.Simulator):
             self.instances[pflow][instance] = parameters    
 
     def finalize(self):
-        print("simulator_pflow::finalize:total execution time = ", self.total_exec_time)
-        print("simulator_pflow::finalize:total steps = ", self.step_count)
-        sys.stdout.flush()
+        #--- collect the report and write it in one go
+        report = io.StringIO()
+        if (self.verbose > 0): print("simulator_pflow::finalize:total execution time = ", self.total_exec_ns / 1e9, file=report)
+        print("simulator_pflow::finalize:total steps = ", self.step_count, file=report)
+        sys.stdout.write(report.getvalue())
+        if self.flush_stdout: sys.stdout.flush()
 